@@ -0,0 +1,121 @@
+# benchmark.py
+# Mede cada etapa do process_file em razões sintéticos e compara com um baseline salvo.
+import argparse
+import contextlib
+import io
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+import pandas as pd
+
+import conta_transitoria as ct
+from gerador_razao import gerar_razao, salvar_xlsx
+
+TAMANHOS = (10_000, 100_000, 1_000_000)
+BASELINE_PATH = Path(__file__).resolve().parent / "benchmark_baseline.json"
+TOLERANCIA = 0.25       # regressão = etapa 25% mais lenta que o baseline...
+MIN_DELTA_S = 0.05      # ...e pelo menos 50 ms mais lenta (ignora ruído em etapas curtas)
+FIXTURE_DIR = Path(tempfile.gettempdir()) / "conta_transitoria_bench"
+
+def _fixture(linhas: int, seed=0) -> Path:
+    # gerar 1M linhas em xlsx leva tempo: reaproveita entre execuções
+    FIXTURE_DIR.mkdir(parents=True, exist_ok=True)
+    path = FIXTURE_DIR / f"razao_{linhas}_{seed}.xlsx"
+    if not path.exists():
+        print(f"[INFO] Gerando razão sintético de {linhas} linhas em {path}...")
+        salvar_xlsx(gerar_razao(linhas, dias=22, dias_desbalanceados=max(3, linhas // 20000), seed=seed), path)
+    return path
+
+class _Cronometro:
+    """Recebe os ganchos _etapa do process_file (mesma interface do StageProfiler),
+    só com tempo de parede: o tracemalloc do --profile distorceria os tempos."""
+
+    def __init__(self):
+        self.tempos = {}
+        self.busca = []     # preenchido por pick_responsible_sets, um item por dia
+
+    @contextlib.contextmanager
+    def etapa(self, nome):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.tempos[nome] = self.tempos.get(nome, 0.0) + time.perf_counter() - t0
+
+def _etapas(path: Path, writer: str) -> dict:
+    """Roda o process_file real (sem cache) e devolve o tempo de cada etapa."""
+    ct._extract_note_ids_cached.cache_clear()
+    cronometro = _Cronometro()
+    with tempfile.TemporaryDirectory() as tmp:
+        # cópia numa pasta temporária: o relatório é gravado ao lado da planilha
+        copia = Path(tmp) / path.name
+        shutil.copyfile(path, copia)
+        ct._PERFIL = cronometro
+        try:
+            ct.process_file(copia, use_cache=False, writer=writer, profile=False)
+        finally:
+            ct._PERFIL = None
+    tempos = dict(cronometro.tempos)
+    tempos[f"escrita_{writer}"] = tempos.pop("escrita", 0.0)
+    tempos["total"] = sum(tempos.values())
+    # parte da etapa "selecao"; fora do total
+    tempos["pick_responsible_sets"] = sum(b["segundos"] for b in cronometro.busca)
+    return tempos
+
+def rodar(tamanhos=TAMANHOS, repeticoes=3, writer=None) -> dict:
+    writer = ct._resolve_writer(writer)
+    resultado = {}
+    for n in tamanhos:
+        path = _fixture(n)
+        melhores = {}
+        for _ in range(repeticoes):
+            with contextlib.redirect_stdout(io.StringIO()):
+                tempos = _etapas(path, writer)
+            for k, v in tempos.items():
+                melhores[k] = min(v, melhores.get(k, float("inf")))
+        resultado[str(n)] = melhores
+        print(f"\n== {n} linhas (melhor de {repeticoes}) ==")
+        for k, v in melhores.items():
+            print(f"  {k:<24} {v:8.3f}s")
+    return resultado
+
+def comparar(resultado: dict, baseline: dict) -> list:
+    regressoes = []
+    for n, etapas in resultado.items():
+        base = baseline.get("resultados", {}).get(n, {})
+        for etapa, t in etapas.items():
+            b = base.get(etapa)
+            if b is not None and t > b * (1 + TOLERANCIA) and t - b > MIN_DELTA_S:
+                regressoes.append(f"{n} linhas / {etapa}: {b:.3f}s -> {t:.3f}s (+{(t / b - 1) * 100:.0f}%)")
+    return regressoes
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark das etapas da conciliação da conta transitória.")
+    ap.add_argument("--tamanhos", type=int, nargs="+", default=list(TAMANHOS), help="linhas de cada razão sintético")
+    ap.add_argument("--repeticoes", type=int, default=3)
+    ap.add_argument("--writer", choices=ct.WRITERS, default=ct.REPORT_WRITER)
+    ap.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    ap.add_argument("--salvar-baseline", action="store_true", help="grava os tempos medidos como novo baseline")
+    args = ap.parse_args()
+
+    resultado = rodar(args.tamanhos, args.repeticoes, args.writer)
+
+    if args.salvar_baseline:
+        meta = {"python": platform.python_version(), "pandas": pd.__version__, "maquina": platform.node(),
+                "data": time.strftime("%Y-%m-%d %H:%M:%S")}
+        args.baseline.write_text(json.dumps({"meta": meta, "resultados": resultado}, indent=2), encoding="utf-8")
+        print(f"\nBaseline salvo em: {args.baseline}")
+    elif args.baseline.exists():
+        regressoes = comparar(resultado, json.loads(args.baseline.read_text(encoding="utf-8")))
+        if regressoes:
+            print("\n== REGRESSÕES ==")
+            print("\n".join(regressoes))
+            sys.exit(1)
+        print("\nSem regressões em relação ao baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,29 @@
 # conta_transitoria.py
+import os
 import sys
+import io
+import json
+import hashlib
+import argparse
+import contextlib
+import cProfile
+import tracemalloc
 import re
 import glob
+import time
+import threading
+import traceback
+from dataclasses import dataclass
+from datetime import date, datetime
 from pathlib import Path
+import numpy as np
 import pandas as pd
-from itertools import combinations
-from openpyxl import load_workbook  # usado no writer; leitura ignora estilos
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from itertools import combinations, islice
+from openpyxl import load_workbook  # usado no modo --stream (read_only)
 
 # ======= CONFIGURAÇÕES =======
 COLUMN_ALIASES = {
@@ -14,42 +32,113 @@ COLUMN_ALIASES = {
     "debit": [r"^d[eé]bito$", r"^valor\s*d[eé]bito$", r"^vlr\s*d[eé]bito$", r"^debito$"],
     "credit":[r"^cr[eé]dito$", r"^valor\s*cr[eé]dito$", r"^vlr\s*cr[eé]dito$", r"^credito$"],
     "batch": [r"^lote$", r"^n[ºo]\s*lote$"],
+    "account": [r"^conta(\s+cont[aá]bil)?$", r"^c[oó]d(igo)?\.?\s*(da\s+)?conta$", r"^filial$"],
 }
 
 EPS = 0.01
+TOL_CENTS = int(round(EPS * 100))   # mesma tolerância, em centavos (valores internos são int)
+MONEY_COLS = ("Debito", "Credito", "Valor", "Diferenca", "DiferencaNotaDia", "Diferenca_Contrapartida")
 USE_FIRST_NOTE_ONLY = True
+CROSS_DAY_MATCHING = True   # liquida pares (NotaID, valor) entre dias antes da busca por dia
+ENGINE = "pandas"           # pandas | polars (agregações multithread; requer polars instalado)
+ENGINES = ("pandas", "polars")
+PARTITION_BY = None         # None = razão inteiro; "lote"/"conta" (COLUMN_ALIASES) ou o nome de uma coluna
 
 import tempfile
 import shutil
 
+# ======= PERFIL DE EXECUÇÃO (opt-in: --profile ou CONTA_TRANSITORIA_PROFILE=1) =======
+PROFILE_ENABLED = os.environ.get("CONTA_TRANSITORIA_PROFILE", "") not in ("", "0")
+
+def _rss_pico_mb():
+    # pico de memória do processo até agora (None se não houver como medir)
+    try:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / 1024 / 1024 if sys.platform == "darwin" else pico / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024 / 1024
+    except Exception:
+        return None
+
+class StageProfiler:
+    """Tempo de parede, CPU e pico de memória (tracemalloc/RSS) por etapa,
+    mais o detalhe da busca de cada dia em pick_responsible_sets."""
+
+    def __init__(self):
+        self.etapas = {}
+        self.busca = []
+        self._tracemalloc = not tracemalloc.is_tracing()
+        if self._tracemalloc:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def etapa(self, nome):
+        tracemalloc.reset_peak()
+        w0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            e = self.etapas.setdefault(nome, {"chamadas": 0, "parede_s": 0.0, "cpu_s": 0.0, "pico_tracemalloc_mb": 0.0})
+            e["chamadas"] += 1
+            e["parede_s"] += time.perf_counter() - w0
+            e["cpu_s"] += time.process_time() - c0
+            e["pico_tracemalloc_mb"] = max(e["pico_tracemalloc_mb"], tracemalloc.get_traced_memory()[1] / 1024 / 1024)
+            e["rss_pico_mb"] = _rss_pico_mb()
+
+    def close(self):
+        if self._tracemalloc:
+            tracemalloc.stop()
+
+    def save(self, path: Path, arquivo: Path):
+        rel = {
+            "arquivo": str(arquivo),
+            "gerado_em": datetime.now().isoformat(timespec="seconds"),
+            "etapas": self.etapas,
+            "busca_por_dia": self.busca,
+            "busca_total": {
+                "dias": len(self.busca),
+                "prefixos": sum(b["prefixos"] for b in self.busca),
+                "segundos": sum(b["segundos"] for b in self.busca),
+            },
+        }
+        path.write_text(json.dumps(rel, indent=2, ensure_ascii=False), encoding="utf-8")
+
+_PERFIL = None   # StageProfiler ativo durante process_file com profiling
+
+def _etapa(nome):
+    return _PERFIL.etapa(nome) if _PERFIL is not None else contextlib.nullcontext()
+
 # ======= LEITURA COM DETECÇÃO DE CABEÇALHO =======
+HEADER_SCAN_ROWS = 50     # linhas lidas para procurar o cabeçalho antes da leitura completa
+
+HDR_DATE = re.compile(r"\bdata\b|lan[cç]amento|emiss[aã]o")
+HDR_HIST = re.compile(r"hist[oó]rico|descri[cç][aã]o")
+HDR_DEB  = re.compile(r"d[eé]bito|debito")
+HDR_CRED = re.compile(r"cr[eé]dito|credito")
+HDR_VAL  = re.compile(r"d[eé]bito|cr[eé]dito|debito|credito")
+
 def _detect_header_row(temp_df: pd.DataFrame) -> int:
-    header_row = None
-    for i, row in temp_df.iterrows():
-        row_str = row.astype(str).str.lower()
-        has_date = row_str.str.contains(r"\bdata\b|lan[cç]amento|emiss[aã]o", regex=True, na=False).any()
-        has_hist = row_str.str.contains(r"hist[oó]rico|descri[cç][aã]o", regex=True, na=False).any()
-        has_deb  = row_str.str.contains(r"d[eé]bito|debito", regex=True, na=False).any()
-        has_cred = row_str.str.contains(r"cr[eé]dito|credito", regex=True, na=False).any()
-        if has_date and (has_hist or has_deb or has_cred) and (has_deb or has_cred):
-            header_row = i
-            break
-    if header_row is None:
-        for i, row in temp_df.iterrows():
-            row_str = row.astype(str).str.lower()
-            score = 0
-            score += row_str.str.contains(r"\bdata\b|lan[cç]amento|emiss[aã]o", regex=True, na=False).any()
-            score += row_str.str.contains(r"hist[oó]rico|descri[cç][aã]o", regex=True, na=False).any()
-            score += row_str.str.contains(r"d[eé]bito|cr[eé]dito|debito|credito", regex=True, na=False).any()
-            if score >= 2:
-                header_row = i
-                break
-    if header_row is None:
+    # testa o bloco inteiro de uma vez: uma coluna por vez, padrões já compilados
+    block = temp_df.astype(str).apply(lambda c: c.str.lower())
+    def hit(pat):
+        return block.apply(lambda c: c.str.contains(pat, na=False)).any(axis=1).to_numpy()
+    has_date, has_hist = hit(HDR_DATE), hit(HDR_HIST)
+    has_deb, has_cred = hit(HDR_DEB), hit(HDR_CRED)
+
+    ok = has_date & (has_deb | has_cred)
+    if not ok.any():
+        score = has_date.astype(int) + has_hist + hit(HDR_VAL)
+        ok = score >= 2
+    if not ok.any():
         raise ValueError("Não consegui localizar a linha de cabeçalho com 'Data/Histórico/Débito/Crédito'.")
-    return header_row
+    return temp_df.index[ok.argmax()]
 
-def _finalize_from_temp(temp: pd.DataFrame, header_row: int) -> pd.DataFrame:
-    print(f"[INFO] Cabeçalho detectado na linha (0-based): {header_row}")
+def _finalize_from_temp(temp: pd.DataFrame, header_row: int, log=print) -> pd.DataFrame:
+    log(f"[INFO] Cabeçalho detectado na linha (0-based): {header_row}")
     header_vals = list(temp.iloc[header_row])
     cols = []
     for idx, c in enumerate(header_vals):
@@ -65,14 +154,35 @@ def _finalize_from_temp(temp: pd.DataFrame, header_row: int) -> pd.DataFrame:
     df.columns = [str(c).strip() for c in df.columns]
     return df
 
-def read_with_header_detection(path: Path) -> pd.DataFrame:
+def _read_sheet(path: Path, engine=None, scan_rows=None, log=print) -> pd.DataFrame:
+    """Procura o cabeçalho só nas primeiras `scan_rows` linhas e lê os dados já
+    a partir dele, com o cabeçalho nomeando as colunas (dtypes inferidos)."""
+    scan_rows = HEADER_SCAN_ROWS if scan_rows is None else scan_rows
+    head = pd.read_excel(path, header=None, nrows=scan_rows, engine=engine)
+    try:
+        header_row = _detect_header_row(head)
+    except ValueError:
+        if len(head) < scan_rows:
+            raise
+        # cabeçalho além da janela: volta à varredura da planilha inteira
+        temp = pd.read_excel(path, header=None, engine=engine)
+        return _finalize_from_temp(temp, _detect_header_row(temp), log=log)
+
+    log(f"[INFO] Cabeçalho detectado na linha (0-based): {header_row}")
+    df = pd.read_excel(path, header=header_row, engine=engine)
+    df.columns = [f"Unnamed: {i}" if str(c).strip().lower() in ("", "nan") else c
+                  for i, c in enumerate(df.columns)]
+    df = df.dropna(axis=1, how="all")
+    df = df.dropna(how="all").reset_index(drop=True)
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+def read_with_header_detection(path: Path, scan_rows=None, log=print) -> pd.DataFrame:
     # 1) tenta engine 'calamine'
     try:
-        temp = pd.read_excel(path, header=None, engine="calamine")
-        header_row = _detect_header_row(temp)
-        return _finalize_from_temp(temp, header_row)
+        return _read_sheet(path, engine="calamine", scan_rows=scan_rows, log=log)
     except Exception:
-        print("[WARN] Falha no engine 'calamine' (ou não instalado). Tentando limpar via Excel/COM...")
+        log("[WARN] Falha no engine 'calamine' (ou não instalado). Tentando limpar via Excel/COM...")
 
     # 2) fallback: Excel/COM re-salva um XLSX limpo
     try:
@@ -91,9 +201,7 @@ def read_with_header_detection(path: Path) -> pd.DataFrame:
         wb.Close(False)
         excel.Quit()
 
-        temp = pd.read_excel(cleaned_path, header=None)
-        header_row = _detect_header_row(temp)
-        df = _finalize_from_temp(temp, header_row)
+        df = _read_sheet(cleaned_path, scan_rows=scan_rows, log=log)
 
         try:
             shutil.rmtree(tmpdir)
@@ -109,7 +217,7 @@ def read_with_header_detection(path: Path) -> pd.DataFrame:
         ) from e2
 
 # ======= AUXILIARES =======
-def normalize_cols(df: pd.DataFrame):
+def normalize_cols(df: pd.DataFrame, log=print):
     colmap = {}
     for canon, patterns in COLUMN_ALIASES.items():
         for c in df.columns:
@@ -120,7 +228,7 @@ def normalize_cols(df: pd.DataFrame):
     if missing:
         raise ValueError("Não consegui identificar as colunas obrigatórias: " + ", ".join(missing) +
                          f". Colunas disponíveis: {list(df.columns)}.\n→ Ajuste COLUMN_ALIASES.")
-    print("[INFO] Colunas mapeadas:", {k: colmap[k] for k in colmap})
+    log("[INFO] Colunas mapeadas:", {k: colmap[k] for k in colmap})
     return colmap
 
 def to_number(x):
@@ -135,23 +243,75 @@ def to_number(x):
     try: return float(s)
     except ValueError: return pd.NA
 
+def to_number_series(col: pd.Series) -> pd.Series:
+    """Versão vetorizada de `to_number` (mesmas regras para 1.234,56 x 1234.56)."""
+    vazio = col.isna()
+    s = col.astype(str).str.strip()
+    vazio |= s.eq("")
+    s = s.str.replace(r"[^\d,.\-]", "", regex=True)
+    last_c = s.str.rfind(",")
+    last_d = s.str.rfind(".")
+    br = (last_c >= 0) & (last_d >= 0) & (last_c > last_d)   # 1.234,56
+    so_virgula = (last_c >= 0) & (last_d < 0)                 # 1234,56
+    s = s.mask(br, s.str.replace(".", "", regex=False))
+    s = s.mask(br | so_virgula, s.str.replace(",", ".", regex=False))
+    out = pd.to_numeric(s.mask(vazio), errors="coerce")
+    return out.astype("Float64")
+
+def to_cents_series(col: pd.Series) -> pd.Series:
+    # centavos inteiros (Int64 para manter células vazias como <NA>)
+    return (to_number_series(col) * 100).round().astype("Int64")
+
+def _to_reais(frame: pd.DataFrame) -> pd.DataFrame:
+    """Converte as colunas de dinheiro de centavos para reais (só na saída)."""
+    out = frame.copy()
+    for c in MONEY_COLS:
+        if c in out.columns:
+            reais = out[c].astype("Float64") / 100
+            out[c] = reais.astype(float) if c.startswith("Diferenca") else reais
+    return out
+
+DATE_FORMATS = ("%d/%m/%Y", "%d/%m/%Y %H:%M:%S", "%Y-%m-%d", "%Y-%m-%d %H:%M:%S")
+
 def parse_date(col):
-    return pd.to_datetime(col, errors="coerce", dayfirst=True)
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col
+    out = pd.Series(pd.NaT, index=col.index, dtype="datetime64[ns]")
+    pendente = col.notna()
+    # caminho rápido: formatos explícitos, só nas células ainda não resolvidas
+    for fmt in DATE_FORMATS:
+        if not pendente.any():
+            return out
+        out.loc[pendente] = pd.to_datetime(col[pendente], format=fmt, errors="coerce")
+        pendente &= out.isna()
+    # fallback: inferência com dayfirst (comportamento original)
+    if pendente.any():
+        out.loc[pendente] = pd.to_datetime(col[pendente], errors="coerce", dayfirst=True)
+    return out
 
 def consolidate_history(df, col_date, col_hist):
-    df = df.copy()
-    df["_has_date"] = ~df[col_date].isna()
-    df["_hist_add"] = (~df["_has_date"]) & df[col_hist].notna() & (df[col_hist].astype(str).str.strip() != "")
-    df["_anchor_idx"] = df.index.to_series().where(df["_has_date"]).ffill()
-    cont = df[df["_hist_add"]]
-    if not cont.empty:
-        add_text = cont.groupby("_anchor_idx")[col_hist].apply(lambda s: " | ".join(s.astype(str)))
-        for anchor, extra in add_text.items():
-            base = str(df.at[anchor, col_hist]) if pd.notna(df.at[anchor, col_hist]) else ""
-            sep = " | " if base and extra else ""
-            df.at[anchor, col_hist] = f"{base}{sep}{extra}"
-    df = df[df["_has_date"]].copy()
-    df.drop(columns=["_has_date", "_hist_add", "_anchor_idx"], inplace=True)
+    has_date = df[col_date].notna().to_numpy()
+    hist = df[col_hist]
+    hist_add = ~has_date & hist.notna().to_numpy() & (hist.astype(str).str.strip() != "").to_numpy()
+    # âncora = posição da última linha com data (linhas antes da primeira ficam sem âncora)
+    anchor = pd.Series(np.where(has_date, np.arange(len(df)), np.nan)).ffill().to_numpy()
+
+    df = df[has_date].copy()
+    hist_add &= ~np.isnan(anchor)
+    if hist_add.any():
+        # continuações são contíguas por âncora: junta com reduceat em vez de groupby-apply
+        keys = anchor[hist_add].astype(np.int64)
+        vals = hist[hist_add].astype(str).to_numpy(dtype=object)
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        first = np.zeros(len(vals), dtype=bool); first[starts] = True
+        extra = np.add.reduceat(np.where(first, vals, " | " + vals), starts)
+        # posições no frame original -> posições no frame só com datas
+        pos_new = np.cumsum(has_date)[keys[starts]] - 1
+        col_idx = df.columns.get_loc(col_hist)
+        base = df.iloc[pos_new, col_idx]
+        base = base.astype(str).where(base.notna(), "").to_numpy(dtype=object)
+        sep = np.where(base != "", " | ", "")
+        df.iloc[pos_new, col_idx] = base + sep + extra
     return df
 
 # ======= EXTRAÇÃO DE NOTA: NF-FIRST + FALLBACK =======
@@ -170,16 +330,20 @@ def _normalize_note(token: str) -> str:
         base = str(int(base))
     return f"{base}{sep}{suf}" if sep and suf is not None else base
 
+NOTE_CACHE_SIZE = 65536   # históricos distintos mantidos no cache LRU
+
 def extract_note_ids(text):
     if pd.isna(text): return []
-    raw = str(text)
+    return list(_extract_note_ids_cached(str(text)))
 
+@lru_cache(maxsize=NOTE_CACHE_SIZE)
+def _extract_note_ids_cached(raw: str) -> tuple:
     # 1) prioriza número logo após NF/NFE
     nf_hits = [m.group(1) for m in NF_NUMBER.finditer(raw)]
     nf_hits = [h for h in nf_hits if not DATE_LIKE.search(h)]
     if nf_hits:
         best = _normalize_note(nf_hits[-1])
-        return [best]
+        return (best,)
 
     # 2) fallback geral
     cands = []
@@ -189,122 +353,285 @@ def extract_note_ids(text):
             continue
         cands.append(_normalize_note(token))
     if not cands:
-        return []
+        return ()
     cands.sort(key=lambda s: (("/" in s) or ("-" in s), len(re.sub(r"\D", "", s))), reverse=True)
-    return [cands[0]] if USE_FIRST_NOTE_ONLY else cands
+    return (cands[0],) if USE_FIRST_NOTE_ONLY else tuple(cands)
+
+def note_cache_info():
+    """Contadores do cache de extração (hits, misses, maxsize, currsize)."""
+    return _extract_note_ids_cached.cache_info()
+
+def extract_note_ids_series(col: pd.Series) -> pd.Series:
+    """Aplica `extract_note_ids` uma vez por histórico distinto e replica o
+    resultado para todas as linhas (factorize + take)."""
+    codes, uniques = pd.factorize(col)
+    results = np.empty(len(uniques) + 1, dtype=object)
+    for i, u in enumerate(uniques):
+        results[i] = extract_note_ids(u)
+    results[-1] = []  # código -1 = histórico vazio
+    return pd.Series(results[codes], index=col.index)
 
-# ======= SELEÇÃO DE RESPONSÁVEIS (subset até 4 notas) =======
-def _close(a, b, eps=EPS):
-    return abs(a - b) <= eps
+# ======= SELEÇÃO DE RESPONSÁVEIS (subset-sum em centavos) =======
+MAX_SET_SIZE = 6          # maior quantidade de notas numa combinação exata
+APPROX_SET_SIZE = 4       # limite do fallback aproximado (maiores diferenças)
+DAY_TIME_BUDGET = 5.0     # segundos de busca exata por dia problemático
+PAIR_INDEX_MAX_NOTES = 500    # acima disso, índice por valor em vez de pares (O(n²) em memória)
+
+class _Timeout(Exception):
+    pass
+
+def _build_index(values, deadline):
+    """Índice dos últimos elementos da combinação: soma -> [(l, m), ...] (pares,
+    meet-in-the-middle) ou, acima de PAIR_INDEX_MAX_NOTES, valor -> [(m,), ...]
+    (O(n) em memória). Listas em ordem lexicográfica (mesma ordem de combinations)."""
+    n = len(values)
+    index = {}
+    if n > PAIR_INDEX_MAX_NOTES:
+        for m, v in enumerate(values):
+            index.setdefault(v, []).append((m,))
+        return 1, index
+    montados = 0
+    for l in range(n):
+        vl = values[l]
+        for m in range(l + 1, n):
+            montados += 1
+            if not montados & 65535 and time.perf_counter() > deadline:
+                raise _Timeout()
+            index.setdefault(vl + values[m], []).append((l, m))
+    return 2, index
+
+def _first_combo(values, k, target, tol, index, deadline, stats=None):
+    """Primeira combinação de tamanho k (na ordem de itertools.combinations)
+    cuja soma fica a até `tol` centavos do alvo. Os últimos índices saem do
+    índice de _build_index; o prefixo é enumerado."""
+    n = len(values)
+    if k == 1:
+        for i, v in enumerate(values):
+            if abs(v - target) <= tol:
+                if stats is not None: stats["prefixos"] += i + 1
+                return (i,)
+        if stats is not None: stats["prefixos"] += n
+        return None
+
+    cauda, index = index
+    tried = 0
+    try:
+        for prefix in combinations(range(n - cauda), k - cauda):
+            tried += 1
+            if not tried & 1023 and time.perf_counter() > deadline:
+                raise _Timeout()
+            need = target - sum(values[i] for i in prefix)
+            start = (prefix[-1] + 1,) if prefix else (0,)
+            best = None
+            for v in range(need - tol, need + tol + 1):
+                tails = index.get(v)
+                if not tails:
+                    continue
+                pos = bisect_left(tails, start)
+                if pos < len(tails) and (best is None or tails[pos] < best):
+                    best = tails[pos]
+            if best is not None:
+                return prefix + best
+        return None
+    finally:
+        if stats is not None: stats["prefixos"] += tried
+
+def _approx_set(diffs, target):
+    # se não achar combinação exata, aproxima com as maiores diferenças
+    diffs_sorted = sorted(diffs, key=lambda t: abs(t[1]), reverse=True)
+    best = None; best_gap = float("inf")
+    for k in range(1, min(APPROX_SET_SIZE, len(diffs_sorted)) + 1):
+        s = sum(d for _, d in diffs_sorted[:k])
+        gap = abs(s - target)
+        if gap < best_gap:
+            best_gap, best = gap, {n for n, _ in diffs_sorted[:k]}
+    return best or set()
+
+def pick_responsible_sets(por_dia_nota, dias_com_diff, max_set_size=MAX_SET_SIZE, time_budget=DAY_TIME_BUDGET,
+                          log=print):
+    tol = TOL_CENTS
+    candidatos = por_dia_nota[por_dia_nota["Diferenca"].abs() > TOL_CENTS]
+    por_dia = {dia: g for dia, g in candidatos.groupby("Dia", sort=False, observed=True)}
 
-def pick_responsible_sets(por_dia_nota, dias_com_diff):
     selected = {}
-    for _, row in dias_com_diff.iterrows():
-        dia = row["Dia"]
-        target = float(row["Diferenca"])
-        sample = por_dia_nota[(por_dia_nota["Dia"] == dia) & (por_dia_nota["Diferenca"].abs() > EPS)].copy()
-        diffs = list(zip(sample["NotaID"], sample["Diferenca"].astype(float)))
+    for dia, target in zip(dias_com_diff["Dia"], dias_com_diff["Diferenca"]):
+        sample = por_dia.get(dia)
+        if sample is None:
+            selected[dia] = set()
+            continue
+        # valores já em centavos: comparação inteira exata
+        diffs = list(zip(sample["NotaID"].tolist(), sample["Diferenca"].astype("int64").tolist()))
+        values = [d for _, d in diffs]
+        alvo = int(target)
+        t0 = time.perf_counter()
+        deadline = t0 + time_budget
+        stats = {"prefixos": 0}   # prefixos enumerados (k=1: notas testadas)
+        metodo = "exata"
         found = set()
 
-        # tenta tamanhos de 1..4
-        for k in range(1, min(4, len(diffs)) + 1):
-            solved = False
-            for combo in combinations(diffs, k):
-                s = sum(d for _, d in combo)
-                if _close(s, target):
-                    found = {n for n, _ in combo}
-                    solved = True
+        # tenta tamanhos de 1..max_set_size (menor conjunto primeiro); em cada tamanho,
+        # soma exata primeiro e só então diferença de até `tol` centavos
+        try:
+            index = None
+            for k in range(1, min(max_set_size, len(values)) + 1):
+                if k >= 2 and index is None:
+                    index = _build_index(values, deadline)
+                for tol_k in dict.fromkeys((0, tol)):
+                    combo = _first_combo(values, k, alvo, tol_k, index, deadline, stats)
+                    if combo is not None:
+                        break
+                if combo is not None:
+                    found = {diffs[i][0] for i in combo}
                     break
-            if solved:
-                break
+        except _Timeout:
+            metodo = "tempo_esgotado"
+            log(f"[WARN] Busca exata de {dia} excedeu {time_budget:.1f}s; usando aproximação.")
 
-        # se não achar combinação exata, aproxima com as maiores diferenças
         if not found and diffs:
-            diffs_sorted = sorted(diffs, key=lambda t: abs(t[1]), reverse=True)
-            best = None; best_gap = float("inf")
-            for k in range(1, min(4, len(diffs_sorted)) + 1):
-                s = sum(d for _, d in diffs_sorted[:k])
-                gap = abs(s - target)
-                if gap < best_gap:
-                    best_gap, best = gap, {n for n, _ in diffs_sorted[:k]}
-            found = best or set()
+            metodo = "aproximada" if metodo == "exata" else metodo
+            found = _approx_set(diffs, alvo)
+        if _PERFIL is not None:
+            _PERFIL.busca.append({"Dia": str(dia), "notas": len(values), "prefixos": stats["prefixos"],
+                                  "segundos": time.perf_counter() - t0, "tamanho": len(found), "metodo": metodo})
 
         selected[dia] = found
     return selected
 
-# ======= PIPELINE PRINCIPAL =======
-def process_file(xlsx_path: Path):
-    df_raw = read_with_header_detection(xlsx_path)
-    if df_raw.empty:
-        raise ValueError("Planilha vazia após detecção de cabeçalho.")
+# ======= PARES ENTRE DIAS (itens em aberto no mês) =======
+def match_cross_day(diffs_por_nota: pd.DataFrame, tol=TOL_CENTS) -> pd.DataFrame:
+    """Casa diferenças da mesma nota que se anulam em dias distintos (ex.:
+    debitada no dia 3 e creditada no dia 5). Índice hash por (NotaID, valor):
+    cada item procura em aberto o valor oposto e, se não achar, fica aberto.
+    Serve para o mês inteiro ou vários meses, conforme o razão lido."""
+    cols = ["NotaID", "Dia", "Diferenca", "Dia_Contrapartida", "Diferenca_Contrapartida", "Dias_Entre"]
+    abertos = {}   # (NotaID, valor) -> deque[(Dia, valor)] na ordem cronológica
+    pares = []
+    ordem = diffs_por_nota.sort_values("Dia", kind="stable")
+    for dia, nota, v in zip(ordem["Dia"], ordem["NotaID"].astype(str), ordem["Diferenca"].astype("int64").tolist()):
+        if nota == "SEM_NOTA":
+            continue
+        par = None
+        for w in range(-v - tol, -v + tol + 1):
+            fila = abertos.get((nota, w))
+            if fila and (par is None or fila[0][0] < par[1][0]):
+                par = (fila, fila[0])
+        if par is None:
+            abertos.setdefault((nota, v), deque()).append((dia, v))
+            continue
+        fila, (dia_ab, v_ab) = par
+        fila.popleft()
+        pares.append((nota, dia_ab, v_ab, dia, v, (dia - dia_ab).days))
+    return pd.DataFrame(pares, columns=cols)
 
-    colmap = normalize_cols(df_raw)
-    col_date  = colmap["date"]
-    col_hist  = colmap["hist"]
-    col_deb   = colmap["debit"]
-    col_cred  = colmap["credit"]
-    col_batch = colmap.get("batch", None)
+def _settle_cross_day(pares: pd.DataFrame, diffs_por_nota: pd.DataFrame, dias_com_diff: pd.DataFrame):
+    """Remove da busca por dia os itens já liquidados entre dias e ajusta o alvo
+    de cada dia. Devolve (diffs restantes, dias a buscar, notas liquidadas por dia)."""
+    liquidadas = {}
+    for dia, nota, v in zip(pd.concat([pares["Dia"], pares["Dia_Contrapartida"]]),
+                            pd.concat([pares["NotaID"], pares["NotaID"]]),
+                            pd.concat([pares["Diferenca"], pares["Diferenca_Contrapartida"]])):
+        liquidadas.setdefault(dia, {})[nota] = int(v)
 
-    df = consolidate_history(df_raw, col_date, col_hist)
-    df[col_date] = parse_date(df[col_date])
-    df["Debito"] = df[col_deb].apply(to_number).astype("Float64")
-    df["Credito"] = df[col_cred].apply(to_number).astype("Float64")
-    df["Valor"] = (df["Debito"].fillna(0) - df["Credito"].fillna(0)).astype("Float64")
+    chaves = pd.MultiIndex.from_arrays(
+        [[d for d, notas in liquidadas.items() for _ in notas],
+         [n for notas in liquidadas.values() for n in notas]],
+        names=["Dia", "NotaID"],
+    )
+    restantes = diffs_por_nota[~pd.MultiIndex.from_frame(diffs_por_nota[["Dia", "NotaID"]].astype(object)).isin(chaves)]
 
-    df = df[df[col_date].notna()].copy()
-    df = df[~(df["Debito"].fillna(0).eq(0) & df["Credito"].fillna(0).eq(0))].copy()
+    ajuste = dias_com_diff["Dia"].map(lambda d: sum(liquidadas.get(d, {}).values())).astype("int64")
+    dias_busca = dias_com_diff.assign(Diferenca=dias_com_diff["Diferenca"] - ajuste)
+    dias_busca = dias_busca[dias_busca["Diferenca"].abs() > TOL_CENTS]
+    return restantes, dias_busca, {d: set(n) for d, n in liquidadas.items()}
+
+# ======= PIPELINE PRINCIPAL =======
+def prepare_ledger(df_raw: pd.DataFrame, colmap: dict) -> pd.DataFrame:
+    """Consolida históricos, converte datas/valores e extrai NotaID e Dia."""
+    col_date, col_hist = colmap["date"], colmap["hist"]
+    with _etapa("consolidate_history"):
+        df = consolidate_history(df_raw, col_date, col_hist)
+    with _etapa("parsing"):
+        df[col_date] = parse_date(df[col_date])
+        df["Debito"] = to_cents_series(df[colmap["debit"]])
+        df["Credito"] = to_cents_series(df[colmap["credit"]])
+        df["Valor"] = (df["Debito"].fillna(0) - df["Credito"].fillna(0)).astype("int64")
+
+        df = df[df[col_date].notna()].copy()
+        df = df[~(df["Debito"].fillna(0).eq(0) & df["Credito"].fillna(0).eq(0))].copy()
 
     # Nota e dia
-    df["NotaIDs"] = df[col_hist].apply(extract_note_ids)
-    df["NotaID"] = df["NotaIDs"].apply(lambda l: l[0] if l else "SEM_NOTA")
-    df["Dia"] = df[col_date].dt.date
+    with _etapa("extract_note_ids"):
+        df["NotaIDs"] = extract_note_ids_series(df[col_hist])
+        df["NotaID"] = df["NotaIDs"].str[0].fillna("SEM_NOTA").astype("category")
+        df["Dia"] = df[col_date].dt.date.astype("category")
+    return df
 
-    # Resumo mensal
-    resumo_mensal = df.agg({"Debito": "sum", "Credito": "sum", "Valor": "sum"}).to_frame(name="Total").T
-    resumo_mensal["Fechou"] = (resumo_mensal["Valor"].abs() <= EPS)
+def _side_counts(df: pd.DataFrame) -> pd.DataFrame:
+    # quantidade de lançamentos a débito/crédito por (Dia, NotaID)
+    return (
+        df.assign(deb=df["Debito"].fillna(0).gt(0), cred=df["Credito"].fillna(0).gt(0))
+          .groupby(["Dia","NotaID"], observed=True)[["deb","cred"]].sum()
+          .reset_index()
+    )
 
-    # Totais por dia
-    dias = df.groupby("Dia", as_index=False).agg(Debito=("Debito","sum"), Credito=("Credito","sum"))
-    dias["Diferenca"] = (dias["Debito"] - dias["Credito"]).astype(float)
-    dias["Fechou"] = dias["Diferenca"].abs() <= EPS
+def _finish_reconciliation(resumo_mensal, dias, por_nota_mes, por_dia_nota, side_by_note, cross_day=CROSS_DAY_MATCHING,
+                           log=print):
+    """Diferenças, dias problemáticos e seleção de responsáveis a partir dos totais."""
+    resumo_mensal["Fechou"] = (resumo_mensal["Valor"].abs() <= TOL_CENTS)
+
+    dias["Diferenca"] = (dias["Debito"] - dias["Credito"]).astype("int64")
+    dias["Fechou"] = dias["Diferenca"].abs() <= TOL_CENTS
     dias_com_diff = dias[~dias["Fechou"]].sort_values("Dia")
 
     # Por nota no mês (informativo)
-    por_nota_mes = df.groupby("NotaID", as_index=False).agg(Debito=("Debito","sum"), Credito=("Credito","sum"))
-    por_nota_mes["Diferenca"] = (por_nota_mes["Debito"] - por_nota_mes["Credito"]).astype(float)
+    por_nota_mes["Diferenca"] = (por_nota_mes["Debito"] - por_nota_mes["Credito"]).astype("int64")
     por_nota_mes = por_nota_mes.sort_values(["Diferenca","NotaID"], ascending=[False, True])
 
     # Por dia + nota
-    por_dia_nota = df.groupby(["Dia","NotaID"], as_index=False).agg(Debito=("Debito","sum"), Credito=("Credito","sum"))
-    por_dia_nota["Diferenca"] = (por_dia_nota["Debito"] - por_dia_nota["Credito"]).astype(float)
+    por_dia_nota["Diferenca"] = (por_dia_nota["Debito"] - por_dia_nota["Credito"]).astype("int64")
 
     # Só dias problemáticos
     dias_problematicos = set(dias_com_diff["Dia"])
     diffs_por_nota = (
         por_dia_nota[
             (por_dia_nota["Dia"].isin(dias_problematicos)) &
-            (por_dia_nota["Diferenca"].abs() > EPS)
+            (por_dia_nota["Diferenca"].abs() > TOL_CENTS)
         ].sort_values(["Dia","Diferenca"], ascending=[True, False])
     )
 
+    # Pares da mesma nota entre dias: liquidados antes da busca combinatória
+    if cross_day:
+        pares = match_cross_day(diffs_por_nota)
+        log(f"[INFO] Pares entre dias: {len(pares)} liquidado(s)")
+    else:
+        pares = match_cross_day(diffs_por_nota.iloc[0:0])
+    diffs_busca, dias_busca, liquidadas = _settle_cross_day(pares, diffs_por_nota, dias_com_diff)
+
     # Seleciona notas responsáveis por dia
-    selected_by_day = pick_responsible_sets(diffs_por_nota, dias_com_diff)
+    achadas = pick_responsible_sets(diffs_busca, dias_busca, log=log)
+    selected_by_day = {d: liquidadas.get(d, set()) | achadas.get(d, set()) for d in dias_com_diff["Dia"]}
 
-    # Flag “Provavel_Responsavel” (fica no Excel)
-    diffs_por_nota["Provavel_Responsavel"] = diffs_por_nota.apply(
-        lambda r: r["NotaID"] in selected_by_day.get(r["Dia"], set()), axis=1
+    # Chaves (Dia, NotaID) selecionadas, para lookup por índice
+    chaves_dia_nota = pd.MultiIndex.from_arrays(
+        [[d for d, notas in selected_by_day.items() for _ in notas],
+         [n for notas in selected_by_day.values() for n in notas]],
+        names=["Dia", "NotaID"],
     )
 
+    # Flag “Provavel_Responsavel” (fica no Excel)
+    diffs_por_nota["Provavel_Responsavel"] = pd.MultiIndex.from_frame(
+        diffs_por_nota[["Dia", "NotaID"]]
+    ).isin(chaves_dia_nota)
+
+    side_by_note["SemContrapartida"] = (side_by_note["deb"].eq(0) | side_by_note["cred"].eq(0))
+    return resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota, pares, selected_by_day, chaves_dia_nota
+
+def _select_rows(df: pd.DataFrame, chaves_dia_nota) -> pd.DataFrame:
     # Lançamentos responsáveis: somente as linhas das notas selecionadas
-    chaves_dia_nota = {(d, n) for d, notas in selected_by_day.items() for n in notas}
-    responsaveis = df[df.apply(lambda r: (r["Dia"], r["NotaID"]) in chaves_dia_nota, axis=1)].copy()
+    return df[pd.MultiIndex.from_frame(df[["Dia", "NotaID"]]).isin(chaves_dia_nota)].copy()
 
+def _build_responsaveis(responsaveis, side_by_note, diffs_por_nota, colmap):
     # Sem contrapartida
-    side_by_note = df.groupby(["Dia","NotaID"]).agg(
-        deb=("Debito", lambda s: (s.fillna(0) > 0).sum()),
-        cred=("Credito", lambda s: (s.fillna(0) > 0).sum())
-    ).reset_index()
-    side_by_note["SemContrapartida"] = (side_by_note["deb"].eq(0) | side_by_note["cred"].eq(0))
     responsaveis = responsaveis.merge(side_by_note[["Dia","NotaID","SemContrapartida"]], on=["Dia","NotaID"], how="left")
 
     # >>> NOVO: valor da diferença da nota no dia (para a aba 'Lancamentos_Responsaveis')
@@ -312,27 +639,121 @@ def process_file(xlsx_path: Path):
     responsaveis = responsaveis.merge(diffs_key, on=["Dia", "NotaID"], how="left")
 
     # Organiza colunas
-    show_cols = ["Dia", col_date, col_hist, "NotaID", "Debito", "Credito", "Valor", "DiferencaNotaDia", "SemContrapartida"]
-    if col_batch and col_batch in df.columns:
+    col_batch = colmap.get("batch", None)
+    show_cols = ["Dia", colmap["date"], colmap["hist"], "NotaID", "Debito", "Credito", "Valor", "DiferencaNotaDia", "SemContrapartida"]
+    if col_batch and col_batch in responsaveis.columns:
         show_cols.insert(1, col_batch)
-    responsaveis = responsaveis[show_cols].sort_values(["Dia","NotaID"])
+    return responsaveis[show_cols].sort_values(["Dia","NotaID"])
 
-    # Saída Excel
-    out_path = xlsx_path.with_name(xlsx_path.stem + "_relatorio.xlsx")
-    with pd.ExcelWriter(out_path, engine="openpyxl") as xlw:
-        resumo_mensal.to_excel(xlw, sheet_name="Resumo_Mensal", index=False)
-        dias.to_excel(xlw, sheet_name="Totais_por_Dia", index=False)
-        dias_com_diff.to_excel(xlw, sheet_name="Dias_com_Diferenca", index=False)
-        por_nota_mes.to_excel(xlw, sheet_name="Notas_Mes", index=False)
-        diffs_por_nota.to_excel(xlw, sheet_name="Diferencas_por_Nota", index=False)
-        responsaveis.to_excel(xlw, sheet_name="Lancamentos_Responsaveis", index=False)
+# ======= SAÍDA =======
+REPORT_WRITER = "openpyxl"   # openpyxl | auto (xlsxwriter se instalado) | xlsxwriter | parquet | csv
+WRITERS = ("auto", "openpyxl", "xlsxwriter", "parquet", "csv")
+INFO_SHEETS = ("Totais_por_Dia", "Notas_Mes")   # informativas; omitidas com --sem-informativos
 
-    # ======= Console =======
-    print("\n== RESUMO MENSAL ==")
-    print(resumo_mensal.to_string(index=False))
+def _resolve_writer(writer=None) -> str:
+    writer = writer or REPORT_WRITER
+    if writer not in WRITERS:
+        raise ValueError(f"Writer desconhecido: {writer}. Opções: {', '.join(WRITERS)}")
+    if writer == "auto":
+        try:
+            import xlsxwriter  # noqa: F401
+            return "xlsxwriter"
+        except ImportError:
+            return "openpyxl"
+    return writer
+
+def _report_path(xlsx_path: Path, writer: str) -> Path:
+    # parquet/csv geram uma pasta com um arquivo por aba
+    if writer in ("parquet", "csv"):
+        return xlsx_path.with_name(xlsx_path.stem + "_relatorio")
+    return xlsx_path.with_name(xlsx_path.stem + "_relatorio.xlsx")
+
+# ordem e nomes das abas, na ordem dos frames devolvidos por _reconcile
+SHEET_NAMES = ("Resumo_Mensal", "Totais_por_Dia", "Dias_com_Diferenca", "Notas_Mes",
+               "Diferencas_por_Nota", "Pares_Entre_Dias", "Lancamentos_Responsaveis")
+
+def _sheets(frames, skip_info=False) -> dict:
+    return {name: frame for name, frame in zip(SHEET_NAMES, frames) if not (skip_info and name in INFO_SHEETS)}
+
+def _report_sheets(resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota, pares, responsaveis,
+                   skip_info=False) -> dict:
+    frames = (resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota, pares, responsaveis)
+    return {name: _to_reais(frame) for name, frame in _sheets(frames, skip_info).items()}
+
+def _write_xlsx_streaming(out_path: Path, sheets: dict):
+    """xlsxwriter em constant_memory: cada linha é descarregada no disco assim
+    que escrita (por isso grava linha a linha, e não via DataFrame.to_excel)."""
+    import xlsxwriter
+    wb = xlsxwriter.Workbook(str(out_path), {"constant_memory": True})
+    try:
+        f_head = wb.add_format({"bold": True})
+        f_date = wb.add_format({"num_format": "yyyy-mm-dd"})
+        f_dt = wb.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+        for name, frame in sheets.items():
+            ws = wb.add_worksheet(name)
+            ws.write_row(0, 0, [str(c) for c in frame.columns], f_head)
+            fmts = [f_dt if pd.api.types.is_datetime64_any_dtype(frame[c]) else None for c in frame.columns]
+            for r, row in enumerate(frame.itertuples(index=False, name=None), start=1):
+                for c, v in enumerate(row):
+                    if v is None or v is pd.NA or v is pd.NaT or (isinstance(v, float) and v != v):
+                        continue
+                    if isinstance(v, datetime):
+                        ws.write_datetime(r, c, v, fmts[c] or f_dt)
+                    elif isinstance(v, date):
+                        ws.write_datetime(r, c, v, f_date)
+                    else:
+                        ws.write(r, c, v)
+    finally:
+        wb.close()
+
+def _write_csv(pasta: Path, name: str, frame: pd.DataFrame) -> Path:
+    destino = pasta / f"{name}.csv"
+    frame.to_csv(destino, index=False, encoding="utf-8-sig")
+    return destino
+
+def _write_parquet(pasta: Path, name: str, frame: pd.DataFrame, log=print) -> Path:
+    destino = pasta / f"{name}.parquet"
+    try:
+        frame.to_parquet(destino, index=False)
+        return destino
+    except ImportError as e:
+        erro = e
+    except Exception:
+        # colunas object com tipos mistos (histórico, lote): grava como texto
+        texto = {c: "string" for c in frame.columns
+                 if frame[c].dtype == object and pd.api.types.infer_dtype(frame[c], skipna=True).startswith("mixed")}
+        try:
+            frame.astype(texto).to_parquet(destino, index=False)
+            return destino
+        except Exception as e:
+            erro = e
+    # sem pyarrow/fastparquet ou ainda inválido: CSV, como o cache cai para pickle
+    destino.unlink(missing_ok=True)
+    log(f"[WARN] Aba {name} não gravada em parquet ({erro}); usando CSV.")
+    return _write_csv(pasta, name, frame)
+
+def _write_report(out_path: Path, sheets: dict, writer="openpyxl", log=print):
+    t0 = time.perf_counter()
+    if writer == "openpyxl":
+        with pd.ExcelWriter(out_path, engine="openpyxl") as xlw:
+            for name, frame in sheets.items():
+                frame.to_excel(xlw, sheet_name=name, index=False)
+    elif writer == "xlsxwriter":
+        _write_xlsx_streaming(out_path, sheets)
+    else:
+        out_path.mkdir(parents=True, exist_ok=True)
+        gravados = [_write_parquet(out_path, name, frame, log) if writer == "parquet" else _write_csv(out_path, name, frame)
+                    for name, frame in sheets.items()]
+    # na pasta, só os arquivos desta execução (pode haver sobras de execuções anteriores)
+    tamanho = out_path.stat().st_size if out_path.is_file() else sum(p.stat().st_size for p in gravados)
+    log(f"[INFO] Relatório gravado ({writer}): {tamanho / 1024:.1f} KiB em {time.perf_counter() - t0:.2f}s")
+
+def _print_summary(resumo_mensal, dias_com_diff, diffs_por_nota, selected_by_day, out_path, log=print):
+    log("\n== RESUMO MENSAL ==")
+    log(_to_reais(resumo_mensal).to_string(index=False))
     if not dias_com_diff.empty:
-        print("\n== DIAS COM DIFERENÇA ==")
-        print(dias_com_diff.to_string(index=False))
+        log("\n== DIAS COM DIFERENÇA ==")
+        log(_to_reais(dias_com_diff).to_string(index=False))
 
         # (Oculto) Diferenças por Nota no console
 
@@ -343,21 +764,777 @@ def process_file(xlsx_path: Path):
             except Exception:
                 return str(v)
 
-        print("\n== NOTAS SELECIONADAS COMO RESPONSÁVEIS ==")
+        diff_dia_nota = diffs_por_nota.groupby(["Dia", "NotaID"], observed=True)["Diferenca"].sum().to_dict()
+        log("\n== NOTAS SELECIONADAS COMO RESPONSÁVEIS ==")
         for d, notas in selected_by_day.items():
             if not notas:
                 continue
             itens = []
             for n in sorted(notas):
-                val = diffs_por_nota.loc[
-                    (diffs_por_nota["Dia"] == d) & (diffs_por_nota["NotaID"] == n),
-                    "Diferenca"
-                ].sum()
+                val = diff_dia_nota.get((d, n), 0) / 100
                 itens.append(f"{n} (R$ {_fmt_brl(val)})")
-            print(f"{d} -> " + ", ".join(itens))
+            log(f"{d} -> " + ", ".join(itens))
+    else:
+        log("\nTodos os dias fecharam em R$ 0,00.")
+    if out_path is not None:
+        log(f"\nRelatório salvo em: {out_path}")
+
+# ======= CACHE DO RAZÃO PARSEADO =======
+PARSER_VERSION = "2"   # incrementar quando a leitura/normalização mudar o frame gerado
+CACHE_DIR = Path(os.environ.get("CONTA_TRANSITORIA_CACHE", Path.home() / ".cache" / "conta_transitoria"))
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+def _cache_key(path: Path) -> str:
+    # conteúdo da planilha + tudo que altera o frame normalizado
+    cfg = f"{PARSER_VERSION}|{HEADER_SCAN_ROWS}|{USE_FIRST_NOTE_ONLY}|{COLUMN_ALIASES}"
+    return _file_sha256(path) + "-" + hashlib.sha256(cfg.encode()).hexdigest()[:12]
+
+def _cache_load(key: str, log=print):
+    meta_path = CACHE_DIR / f"{key}.json"
+    if not meta_path.exists():
+        return None
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        data_path = CACHE_DIR / meta["arquivo"]
+        df = pd.read_parquet(data_path) if data_path.suffix == ".parquet" else pd.read_pickle(data_path)
+        if "NotaIDs" in df.columns:
+            df["NotaIDs"] = df["NotaIDs"].map(list)
+        for p in (meta_path, data_path):  # LRU: marca uso recente
+            os.utime(p)
+        return df, meta["colmap"]
+    except Exception as e:
+        log(f"[WARN] Cache inválido ({e}); relendo a planilha.")
+        return None
+
+def _cache_store(key: str, df: pd.DataFrame, colmap: dict, log=print):
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        data_path = CACHE_DIR / f"{key}.parquet"
+        try:
+            df.to_parquet(data_path, index=False)
+        except Exception:
+            # sem pyarrow ou colunas com tipos mistos: pickle preserva tudo
+            data_path.unlink(missing_ok=True)
+            data_path = CACHE_DIR / f"{key}.pkl"
+            df.to_pickle(data_path)
+        meta = {"arquivo": data_path.name, "colmap": colmap, "parser_version": PARSER_VERSION}
+        (CACHE_DIR / f"{key}.json").write_text(json.dumps(meta), encoding="utf-8")
+        _cache_evict()
+    except Exception as e:
+        log(f"[WARN] Não consegui gravar o cache: {e}")
+
+def _cache_evict(max_bytes=None):
+    # remove as entradas usadas há mais tempo até caber no limite
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entradas = []
+    for meta_path in CACHE_DIR.glob("*.json"):
+        dados = [p for p in CACHE_DIR.glob(meta_path.stem + ".*") if p != meta_path]
+        tamanho = meta_path.stat().st_size + sum(p.stat().st_size for p in dados)
+        entradas.append((meta_path.stat().st_mtime, tamanho, [meta_path, *dados]))
+    total = sum(t for _, t, _ in entradas)
+    for _, tamanho, paths in sorted(entradas, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        for p in paths:
+            p.unlink(missing_ok=True)
+        total -= tamanho
+
+def load_ledger(xlsx_path: Path, use_cache=True, keep_cols=(), log=print):
+    """Razão normalizado (saída de prepare_ledger) e o mapeamento de colunas.
+    Com cache, planilhas já lidas voltam direto do disco. `keep_cols`: colunas
+    extras da planilha que também precisam estar no frame (ex.: partição)."""
+    key = _cache_key(xlsx_path) if use_cache else None
+    if key:
+        with _etapa("cache"):
+            hit = _cache_load(key, log)
+        if hit is not None and all(c in hit[0].columns for c in keep_cols):
+            log(f"[INFO] Razão carregado do cache ({key[:12]}…)")
+            return hit
+
+    with _etapa("leitura"):
+        df_raw = read_with_header_detection(xlsx_path, log=log)
+        if df_raw.empty:
+            raise ValueError("Planilha vazia após detecção de cabeçalho.")
+        colmap = normalize_cols(df_raw, log)
+    df = prepare_ledger(df_raw, colmap)
+    info = note_cache_info()
+    log(f"[INFO] Extração de notas: {info.currsize} históricos em cache (hits={info.hits}, misses={info.misses})")
+
+    if key:
+        keep = {colmap["date"], colmap["hist"], colmap.get("batch"), colmap.get("account"), *keep_cols,
+                "Debito", "Credito", "Valor", "NotaIDs", "NotaID", "Dia"}
+        with _etapa("cache"):
+            _cache_store(key, df[[c for c in df.columns if c in keep]], colmap, log)
+    return df, colmap
+
+def _summary_row(xlsx_path, out_path, resumo_mensal, dias_com_diff) -> dict:
+    # linha do índice do modo lote
+    total = resumo_mensal.iloc[0]
+    return {
+        "Arquivo": xlsx_path.name,
+        "Fechou": bool(total["Fechou"]),
+        "Debito": total["Debito"] / 100,
+        "Credito": total["Credito"] / 100,
+        "Diferenca": total["Valor"] / 100,
+        "Dias_com_Diferenca": len(dias_com_diff),
+        "Relatorio": str(out_path),
+    }
+
+def _resolve_engine(engine=None, log=print) -> str:
+    engine = engine or ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Engine desconhecido: {engine}. Opções: {', '.join(ENGINES)}")
+    if engine == "polars":
+        try:
+            import polars  # noqa: F401
+        except ImportError:
+            log("[WARN] polars não instalado (pip install polars); usando o engine pandas.")
+            return "pandas"
+    return engine
+
+def _aggregate(df: pd.DataFrame):
+    # Resumo mensal
+    resumo_mensal = df.agg({"Debito": "sum", "Credito": "sum", "Valor": "sum"}).to_frame(name="Total").T
+
+    # Totais por dia / por nota no mês / por dia + nota
+    dias = df.groupby("Dia", as_index=False, observed=True).agg(Debito=("Debito","sum"), Credito=("Credito","sum"))
+    por_nota_mes = df.groupby("NotaID", as_index=False, observed=True).agg(Debito=("Debito","sum"), Credito=("Credito","sum"))
+    por_dia_nota = df.groupby(["Dia","NotaID"], as_index=False, observed=True).agg(Debito=("Debito","sum"), Credito=("Credito","sum"))
+    return resumo_mensal, dias, por_nota_mes, por_dia_nota, _side_counts(df)
+
+def _aggregate_polars(df: pd.DataFrame):
+    """Mesmos frames de `_aggregate`, com os group-bys no Polars (todos os
+    núcleos). Agrupa pelos códigos das categorias de Dia/NotaID, cuja ordem é a
+    ordem das chaves no pandas, e devolve as chaves com o dtype original."""
+    import polars as pl
+    dia, nota = df["Dia"], df["NotaID"]
+    dia_cat = dia.astype("category") if not isinstance(dia.dtype, pd.CategoricalDtype) else dia
+    nota_cat = nota.astype("category") if not isinstance(nota.dtype, pd.CategoricalDtype) else nota
+    # célula vazia soma como 0 nos dois engines: entra como 0 (sem cópia para Arrow com máscara)
+    base = pl.DataFrame({
+        "dia": dia_cat.cat.codes.to_numpy(),
+        "nota": nota_cat.cat.codes.to_numpy(),
+        "Debito": df["Debito"].to_numpy(dtype="int64", na_value=0),
+        "Credito": df["Credito"].to_numpy(dtype="int64", na_value=0),
+    }).with_columns(deb=pl.col("Debito").gt(0).cast(pl.Int64), cred=pl.col("Credito").gt(0).cast(pl.Int64))
+    por_chave = (base.lazy().group_by("dia", "nota")
+                 .agg(pl.col("Debito", "Credito", "deb", "cred").sum())
+                 .sort("dia", "nota"))
+    por_dia, por_nota, por_chave = pl.collect_all([
+        por_chave.group_by("dia").agg(pl.col("Debito", "Credito").sum()).sort("dia"),
+        por_chave.group_by("nota").agg(pl.col("Debito", "Credito").sum()).sort("nota"),
+        por_chave,
+    ])
+
+    def chave(codes, original, cat):
+        codes = codes.to_numpy()
+        if isinstance(original.dtype, pd.CategoricalDtype):
+            return pd.Categorical.from_codes(codes, dtype=original.dtype)
+        return cat.cat.categories.to_numpy(dtype=object)[codes]
+
+    def frame(agg, keys, cols):
+        out = pd.DataFrame({name: chave(agg[code], orig, cat) for name, code, orig, cat in keys})
+        for c in cols:
+            out[c] = pd.array(agg[c].to_numpy(), dtype="Int64")
+        return out
+
+    k_dia, k_nota = ("Dia", "dia", dia, dia_cat), ("NotaID", "nota", nota, nota_cat)
+    resumo_mensal = df.agg({"Debito": "sum", "Credito": "sum", "Valor": "sum"}).to_frame(name="Total").T
+    return (resumo_mensal,
+            frame(por_dia, [k_dia], ["Debito", "Credito"]),
+            frame(por_nota, [k_nota], ["Debito", "Credito"]),
+            frame(por_chave, [k_dia, k_nota], ["Debito", "Credito"]),
+            frame(por_chave, [k_dia, k_nota], ["deb", "cred"]))
+
+def _reconcile(df: pd.DataFrame, colmap: dict, cross_day=CROSS_DAY_MATCHING, engine=None, log=print):
+    """Totais, diferenças, seleção e lançamentos responsáveis de um razão já preparado."""
+    with _etapa("agregacao"):
+        aggregate = _aggregate_polars if _resolve_engine(engine, log) == "polars" else _aggregate
+        resumo_mensal, dias, por_nota_mes, por_dia_nota, side_by_note = aggregate(df)
+
+    with _etapa("selecao"):
+        (resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota, pares,
+         selected_by_day, chaves_dia_nota) = _finish_reconciliation(resumo_mensal, dias, por_nota_mes, por_dia_nota,
+                                                                    side_by_note, cross_day=cross_day, log=log)
+
+    with _etapa("responsaveis"):
+        responsaveis = _build_responsaveis(_select_rows(df, chaves_dia_nota), side_by_note, diffs_por_nota, colmap)
+    return resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota, pares, selected_by_day, responsaveis
+
+# ======= API EM MEMÓRIA =======
+LEDGER_COLS = {"Dia", "NotaID", "NotaIDs", "Debito", "Credito", "Valor"}   # marca de frame já preparado
+
+@dataclass
+class ReconciliationResult:
+    """Resultado da conciliação (valores em reais, como nas abas do relatório)."""
+    resumo_mensal: pd.DataFrame
+    dias: pd.DataFrame
+    dias_com_diff: pd.DataFrame
+    por_nota_mes: pd.DataFrame
+    diffs_por_nota: pd.DataFrame
+    pares: pd.DataFrame
+    responsaveis: pd.DataFrame
+    selected_by_day: dict       # Dia -> {NotaID, ...}
+    colmap: dict
+
+    @property
+    def fechou(self) -> bool:
+        return bool(self.resumo_mensal["Fechou"].iloc[0])
+
+    def sheets(self, skip_info=False) -> dict:
+        """Mesmas abas (nome -> DataFrame) que process_file grava no Excel."""
+        return _sheets((self.resumo_mensal, self.dias, self.dias_com_diff, self.por_nota_mes,
+                        self.diffs_por_nota, self.pares, self.responsaveis), skip_info)
+
+def _sem_log(*args, **kwargs):
+    pass
+
+def reconcile(source, colmap=None, cross_day=CROSS_DAY_MATCHING, use_cache=False, engine=None,
+              log=None) -> ReconciliationResult:
+    """Concilia em memória, sem gravar relatório nem imprimir no console.
+
+    `source`: caminho da planilha, DataFrame bruto (colunas como na planilha,
+    cabeçalho já aplicado) ou o razão já preparado por load_ledger/prepare_ledger
+    (nesse caso informe `colmap`). Com `use_cache=True` o cache do razão é
+    usado/atualizado como no process_file. `log`: recebe as mensagens de
+    progresso (mesma assinatura de print; padrão: descartadas)."""
+    log = log or _sem_log
+    if isinstance(source, (str, Path)):
+        df, colmap = load_ledger(Path(source), use_cache=use_cache, log=log)
+    elif colmap is not None and LEDGER_COLS <= set(source.columns):
+        df = source
     else:
-        print("\nTodos os dias fecharam em R$ 0,00.")
-    print(f"\nRelatório salvo em: {out_path}")
+        colmap = colmap or normalize_cols(source, log)
+        df = prepare_ledger(source, colmap)
+    (resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota, pares,
+     selected_by_day, responsaveis) = _reconcile(df, colmap, cross_day=cross_day, engine=engine, log=log)
+    return ReconciliationResult(
+        *(_to_reais(f) for f in (resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota, pares, responsaveis)),
+        selected_by_day=selected_by_day, colmap=colmap,
+    )
+
+def process_file(xlsx_path: Path, stream=False, chunk_size=None, use_cache=True, writer=None, skip_info=False,
+                 cross_day=CROSS_DAY_MATCHING, profile=PROFILE_ENABLED, cprofile=False,
+                 partition=PARTITION_BY, workers=None, engine=None, log=print):
+    kwargs = dict(stream=stream, chunk_size=chunk_size, use_cache=use_cache, writer=writer,
+                  skip_info=skip_info, cross_day=cross_day, partition=partition, workers=workers, engine=engine,
+                  log=log)
+    if not (profile or cprofile):
+        return _process_file(xlsx_path, **kwargs)
+
+    # Perfil: JSON por etapa (+ dump do cProfile) ao lado do relatório
+    global _PERFIL
+    _PERFIL = StageProfiler()
+    prof = cProfile.Profile() if cprofile else None
+    try:
+        if prof: prof.enable()
+        row = _process_file(xlsx_path, **kwargs)
+    finally:
+        if prof: prof.disable()
+        perfil, _PERFIL = _PERFIL, None
+        perfil.close()
+    perfil_path = xlsx_path.with_name(xlsx_path.stem + "_perfil.json")
+    perfil.save(perfil_path, xlsx_path)
+    log(f"[INFO] Perfil por etapa salvo em: {perfil_path}")
+    if prof:
+        prof_path = xlsx_path.with_name(xlsx_path.stem + "_perfil.prof")
+        prof.dump_stats(str(prof_path))
+        log(f"[INFO] cProfile salvo em: {prof_path} (abra com: python -m pstats / snakeviz)")
+    return row
+
+def _process_file(xlsx_path: Path, stream=False, chunk_size=None, use_cache=True, writer=None, skip_info=False,
+                  cross_day=CROSS_DAY_MATCHING, partition=PARTITION_BY, workers=None, engine=None, log=print):
+    if stream:
+        if partition:
+            raise ValueError("Particionamento não é suportado no modo --stream.")
+        return process_file_streaming(xlsx_path, chunk_size=chunk_size, writer=writer, skip_info=skip_info,
+                                      cross_day=cross_day, log=log)
+    if partition:
+        return process_file_partitioned(xlsx_path, partition, workers=workers, use_cache=use_cache,
+                                        writer=writer, skip_info=skip_info, cross_day=cross_day, engine=engine,
+                                        log=log)
+
+    df, colmap = load_ledger(xlsx_path, use_cache=use_cache, log=log)
+    (resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota, pares,
+     selected_by_day, responsaveis) = _reconcile(df, colmap, cross_day=cross_day, engine=engine, log=log)
+
+    # Saída Excel
+    writer = _resolve_writer(writer)
+    out_path = _report_path(xlsx_path, writer)
+    with _etapa("escrita"):
+        _write_report(out_path, _report_sheets(resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota,
+                                               pares, responsaveis, skip_info=skip_info), writer=writer, log=log)
+
+    # ======= Console =======
+    _print_summary(resumo_mensal, dias_com_diff, diffs_por_nota, selected_by_day, out_path, log)
+    return _summary_row(xlsx_path, out_path, resumo_mensal, dias_com_diff)
+
+# ======= PARTIÇÕES (várias contas/lotes na mesma planilha) =======
+PARTITION_KEYS = {"lote": "batch", "conta": "account", "filial": "account"}
+PARTITION_SHEETS = {   # abas de cada partição: <rótulo>_<sufixo> (limite de 31 caracteres do Excel)
+    "Resumo_Mensal": "Resumo", "Totais_por_Dia": "Dias", "Dias_com_Diferenca": "DiasDif", "Notas_Mes": "Notas",
+    "Diferencas_por_Nota": "DifNota", "Pares_Entre_Dias": "Pares", "Lancamentos_Responsaveis": "Resp",
+}
+PARTITION_INDEX_SHEET = "Particoes"
+
+def _partition_column(partition: str, colmap: dict, columns) -> str:
+    # "lote"/"conta" usam o mapeamento de COLUMN_ALIASES; qualquer outro valor é o nome da coluna
+    col = colmap.get(PARTITION_KEYS.get(str(partition).strip().lower(), partition), partition)
+    if col not in columns:
+        raise ValueError(f"Coluna de partição não encontrada: {partition}. Colunas disponíveis: {list(columns)}.")
+    return col
+
+def _partition_labels(values) -> list:
+    # rótulos curtos, sem caracteres proibidos em nome de aba e sem repetição; o Excel
+    # (nomes de aba) e o Windows (arquivos do parquet/csv) não distinguem maiúsculas
+    labels, seen = [], set()
+    for v in values:
+        if isinstance(v, datetime) and v == v.replace(hour=0, minute=0, second=0, microsecond=0):
+            v = v.date()
+        base = re.sub(r"[\[\]:*?/\\']", "_", str(v).strip())[:20] or "VAZIO"
+        label, n = base, 1
+        while label.casefold() in seen:
+            n += 1
+            label = f"{base[:17]}~{n}"
+        seen.add(label.casefold())
+        labels.append(label)
+    return labels
+
+@contextlib.contextmanager
+def _console_capturado():
+    """Para tarefas que rodam num processo do pool (uma por vez em cada processo):
+    captura o console, que volta ao processo principal junto com o resultado e
+    é impresso/gravado lá, sem misturar as saídas dos workers."""
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        yield buf
+
+def _reconcile_worker(label, df, colmap, cross_day, engine):
+    with _console_capturado() as console:
+        result = _reconcile(df, colmap, cross_day=cross_day, engine=engine)
+    return label, result, console.getvalue()
+
+def process_file_partitioned(xlsx_path: Path, partition: str, workers=None, use_cache=True, writer=None,
+                             skip_info=False, cross_day=CROSS_DAY_MATCHING, engine=None, log=print):
+    """Concilia cada valor da coluna de partição (lote, conta, filial...) como um
+    razão independente, em paralelo. Um único relatório com um conjunto de abas
+    por partição e o índice na aba 'Particoes'."""
+    engine = _resolve_engine(engine, log)
+    keep_cols = () if str(partition).strip().lower() in PARTITION_KEYS else (partition,)
+    df, colmap = load_ledger(xlsx_path, use_cache=use_cache, keep_cols=keep_cols, log=log)
+    col = _partition_column(partition, colmap, df.columns)
+
+    chave = df[col].astype(object).where(df[col].notna(), "SEM_" + str(col).upper())
+    grupos = [(int(v) if isinstance(v, float) and v.is_integer() else v, g) for v, g in df.groupby(chave, sort=True)]
+    labels = _partition_labels(v for v, _ in grupos)
+    log(f"[INFO] Partições por '{col}': {len(grupos)} ({', '.join(labels)})")
+
+    def _enxuto(g):
+        # categorias do razão inteiro não interessam à partição
+        return g.assign(**{c: g[c].cat.remove_unused_categories() for c in ("Dia", "NotaID")
+                           if isinstance(g[c].dtype, pd.CategoricalDtype)})
+
+    resultados, logs = {}, {}
+    if len(grupos) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futs = [pool.submit(_reconcile_worker, label, _enxuto(g), colmap, cross_day, engine)
+                    for label, (_, g) in zip(labels, grupos)]
+            for fut in as_completed(futs):
+                label, resultados[label], logs[label] = fut.result()
+    else:
+        for label, (_, g) in zip(labels, grupos):
+            resultados[label] = _reconcile(_enxuto(g), colmap, cross_day=cross_day, engine=engine, log=log)
+
+    indice, sheets = [], {}
+    for label, (valor, _) in zip(labels, grupos):
+        (resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota, pares,
+         selected_by_day, responsaveis) = resultados[label]
+        total = resumo_mensal.iloc[0]
+        indice.append({"Particao": valor, "Abas": label, "Fechou": bool(total["Fechou"]),
+                       "Debito": total["Debito"], "Credito": total["Credito"], "Valor": total["Valor"],
+                       "Dias_com_Diferenca": len(dias_com_diff)})
+        for name, frame in _report_sheets(resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota,
+                                          pares, responsaveis, skip_info=skip_info).items():
+            sheets[f"{label}_{PARTITION_SHEETS[name]}"] = frame
+
+        log(f"\n########## {col} = {valor} ##########")
+        log(logs.get(label, ""), end="")
+        _print_summary(resumo_mensal, dias_com_diff, diffs_por_nota, selected_by_day, None, log)
+
+    indice = pd.DataFrame(indice)
+    writer = _resolve_writer(writer)
+    out_path = _report_path(xlsx_path, writer)
+    with _etapa("escrita"):
+        _write_report(out_path, {PARTITION_INDEX_SHEET: _to_reais(indice), **sheets}, writer=writer, log=log)
+    log(f"\nRelatório salvo em: {out_path}")
+
+    # linha do modo lote: o arquivo só fecha se todas as partições fecharem
+    resumo = indice[["Debito", "Credito", "Valor"]].sum().to_frame(name="Total").T
+    resumo["Fechou"] = bool(indice["Fechou"].all())
+    return {**_summary_row(xlsx_path, out_path, resumo, indice.iloc[0:0]),
+            "Dias_com_Diferenca": int(indice["Dias_com_Diferenca"].sum())}
+
+# ======= MODO STREAMING (planilhas muito grandes) =======
+STREAM_CHUNK_ROWS = 50000   # linhas da planilha processadas por vez no modo --stream
+
+def _header_names(values) -> list:
+    cols, seen = [], {}
+    for idx, c in enumerate(values):
+        name = "" if c is None else str(c).strip()
+        if not name or name.lower() == "nan":
+            name = f"Unnamed: {idx}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        cols.append(name)
+    return cols
+
+def _iter_raw_chunks(path: Path, chunk_size: int, log=print):
+    """Lê a planilha linha a linha (openpyxl read_only) e entrega DataFrames de
+    até `chunk_size` linhas já com os nomes do cabeçalho detectado."""
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        head = list(islice(rows, HEADER_SCAN_ROWS))
+        header_row = _detect_header_row(pd.DataFrame(head))
+        log(f"[INFO] Cabeçalho detectado na linha (0-based): {header_row}")
+        cols = _header_names(head[header_row])
+        width = len(cols)
+
+        batch = head[header_row + 1:]
+        while True:
+            with _etapa("leitura"):
+                batch.extend(islice(rows, max(chunk_size - len(batch), 0)))
+            if not batch:
+                break
+            with _etapa("leitura"):
+                rows_fixed = [tuple(r[:width]) + (None,) * (width - len(r)) for r in batch]
+                chunk = pd.DataFrame(rows_fixed, columns=cols, dtype=object).dropna(how="all")
+            yield chunk
+            if len(batch) < chunk_size:
+                break
+            batch = []
+    finally:
+        wb.close()
+
+def _iter_ledger_chunks(path: Path, chunk_size: int, log=print):
+    """Chunks já preparados (prepare_ledger). As linhas a partir do último
+    lançamento com data ficam retidas para o próximo chunk, porque o histórico
+    desse lançamento pode continuar nele."""
+    colmap, carry = None, None
+    for raw in _iter_raw_chunks(path, chunk_size, log):
+        if colmap is None:
+            colmap = normalize_cols(raw, log)
+        if carry is not None:
+            raw = pd.concat([carry, raw], ignore_index=True)
+            carry = None
+        dated = np.flatnonzero(raw[colmap["date"]].notna().to_numpy())
+        if len(dated):
+            carry = raw.iloc[dated[-1]:]
+            raw = raw.iloc[:dated[-1]]
+        if not raw.empty:
+            yield colmap, prepare_ledger(raw.reset_index(drop=True), colmap)
+    if carry is not None:
+        yield colmap, prepare_ledger(carry.reset_index(drop=True), colmap)
+
+def process_file_streaming(xlsx_path: Path, chunk_size=None, writer=None, skip_info=False,
+                           cross_day=CROSS_DAY_MATCHING, log=print):
+    """Mesmo relatório de `process_file`, com memória limitada pelo tamanho do
+    chunk. 1ª passada: acumula totais por (Dia, NotaID). 2ª passada: guarda só
+    as linhas das notas selecionadas nos dias com diferença."""
+    chunk_size = chunk_size or STREAM_CHUNK_ROWS
+    keys = ["Dia", "NotaID"]
+    acc, colmap, total_linhas = None, None, 0
+    for colmap, df in _iter_ledger_chunks(xlsx_path, chunk_size, log):
+        total_linhas += len(df)
+        with _etapa("agregacao"):
+            part = (
+                df.assign(deb=df["Debito"].fillna(0).gt(0), cred=df["Credito"].fillna(0).gt(0))
+                  .groupby(keys, observed=True)[["Debito", "Credito", "Valor", "deb", "cred"]].sum()
+            )
+            acc = part if acc is None else pd.concat([acc, part]).groupby(level=keys, observed=True).sum()
+    if acc is None or colmap is None:
+        raise ValueError("Planilha vazia após detecção de cabeçalho.")
+    log(f"[INFO] Streaming: {total_linhas} lançamentos em chunks de {chunk_size} linhas")
+
+    with _etapa("agregacao"):
+        acc = acc.reset_index()
+        resumo_mensal = acc[["Debito", "Credito", "Valor"]].sum().to_frame(name="Total").T
+        dias = acc.groupby("Dia", as_index=False, observed=True).agg(Debito=("Debito","sum"), Credito=("Credito","sum"))
+        por_nota_mes = acc.groupby("NotaID", as_index=False, observed=True).agg(Debito=("Debito","sum"), Credito=("Credito","sum"))
+        por_dia_nota = acc[keys + ["Debito", "Credito"]].copy()
+        side_by_note = acc[keys + ["deb", "cred"]].copy()
+
+    with _etapa("selecao"):
+        (resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota, pares,
+         selected_by_day, chaves_dia_nota) = _finish_reconciliation(resumo_mensal, dias, por_nota_mes, por_dia_nota,
+                                                                    side_by_note, cross_day=cross_day, log=log)
+
+    partes = []
+    if len(chaves_dia_nota):
+        for _, df in _iter_ledger_chunks(xlsx_path, chunk_size, log):
+            with _etapa("responsaveis"):
+                partes.append(_select_rows(df, chaves_dia_nota))
+    with _etapa("responsaveis"):
+        linhas = pd.concat(partes, ignore_index=True) if partes else prepare_ledger(
+            pd.DataFrame(columns=list(dict.fromkeys(colmap.values()))), colmap)
+        responsaveis = _build_responsaveis(linhas, side_by_note, diffs_por_nota, colmap)
+
+    writer = _resolve_writer(writer)
+    out_path = _report_path(xlsx_path, writer)
+    with _etapa("escrita"):
+        _write_report(out_path, _report_sheets(resumo_mensal, dias, dias_com_diff, por_nota_mes, diffs_por_nota,
+                                               pares, responsaveis, skip_info=skip_info), writer=writer, log=log)
+    _print_summary(resumo_mensal, dias_com_diff, diffs_por_nota, selected_by_day, out_path, log)
+    return _summary_row(xlsx_path, out_path, resumo_mensal, dias_com_diff)
+
+# ======= MODO LOTE (várias empresas) =======
+BATCH_INDEX_NAME = "_indice_conciliacao.xlsx"
+BATCH_LOG_SUFFIX = "_log.txt"   # console capturado de cada planilha, gravado ao lado dela
+
+def _batch_files(alvo: str) -> list:
+    p = Path(alvo)
+    files = glob.glob(str(p / "*.xls*")) if p.is_dir() else glob.glob(alvo)
+    # ignora relatórios gerados, o próprio índice e temporários do Excel
+    return sorted(
+        Path(f) for f in files
+        if not Path(f).stem.endswith("_relatorio")
+        and Path(f).name != BATCH_INDEX_NAME
+        and not Path(f).name.startswith("~$")
+    )
+
+def _batch_worker(path: str, stream: bool, chunk_size, use_cache=True, writer=None, skip_info=False,
+                  cross_day=CROSS_DAY_MATCHING, profile=PROFILE_ENABLED, partition=PARTITION_BY, engine=None):
+    with _console_capturado() as console:
+        try:
+            row = process_file(Path(path), stream=stream, chunk_size=chunk_size, use_cache=use_cache,
+                               writer=writer, skip_info=skip_info, cross_day=cross_day, profile=profile,
+                               partition=partition, workers=1, engine=engine)
+        except Exception as e:
+            return None, f"{type(e).__name__}: {e}", console.getvalue() + traceback.format_exc()
+    return row, None, console.getvalue()
+
+def _save_batch_log(path: Path, log: str, erro=None) -> str:
+    """Grava o console capturado do worker ao lado da planilha; em caso de erro
+    também o repete no console (traceback incluído)."""
+    if erro and log:
+        print("\n".join(f"    {linha}" for linha in log.rstrip().splitlines()))
+    if not log:
+        return ""
+    log_path = path.with_name(path.stem + BATCH_LOG_SUFFIX)
+    try:
+        log_path.write_text(log, encoding="utf-8")
+    except OSError as e:
+        print(f"[WARN] Não foi possível gravar o log {log_path.name}: {e}")
+        return ""
+    return str(log_path)
+
+def process_batch(alvo: str, workers=None, stream=False, chunk_size=None, use_cache=True,
+                  writer=None, skip_info=False, cross_day=CROSS_DAY_MATCHING, profile=PROFILE_ENABLED,
+                  partition=PARTITION_BY, engine=None) -> Path:
+    """Concilia todas as planilhas de uma pasta (ou glob) em paralelo e grava um
+    índice com Fechou/Diferença por arquivo. Falhas não interrompem o lote."""
+    files = _batch_files(alvo)
+    if not files:
+        raise FileNotFoundError(f"Nenhuma planilha encontrada em: {alvo}")
+    print(f"[INFO] Lote: {len(files)} planilha(s), workers={workers or os.cpu_count()}")
+
+    linhas = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futs = {pool.submit(_batch_worker, str(f), stream, chunk_size, use_cache, writer, skip_info,
+                            cross_day, profile, partition, engine): f for f in files}
+        for fut in as_completed(futs):
+            f = futs[fut]
+            try:
+                row, erro, log = fut.result()
+            except Exception as e:  # processo morto, pickling etc.
+                row, erro, log = None, f"{type(e).__name__}: {e}", ""
+            if erro:
+                print(f"[ERRO] {f.name}: {erro}")
+                linhas.append({"Arquivo": f.name, "Status": "ERRO", "Erro": erro,
+                               "Log": _save_batch_log(f, log, erro)})
+            else:
+                status = "OK" if row["Fechou"] else "DIFERENCA"
+                print(f"[{status}] {f.name}: diferença R$ {row['Diferenca']:.2f}")
+                linhas.append({**row, "Status": status, "Erro": "", "Log": _save_batch_log(f, log)})
+
+    cols = ["Arquivo", "Status", "Fechou", "Debito", "Credito", "Diferenca", "Dias_com_Diferenca", "Relatorio",
+            "Log", "Erro"]
+    indice = pd.DataFrame(linhas).reindex(columns=cols).sort_values("Arquivo")
+    base = Path(alvo) if Path(alvo).is_dir() else files[0].parent
+    out_path = base / BATCH_INDEX_NAME
+    with pd.ExcelWriter(out_path, engine="openpyxl") as xlw:
+        indice.to_excel(xlw, sheet_name="Indice", index=False)
+    falhas = int((indice["Status"] == "ERRO").sum())
+    print(f"\nÍndice do lote salvo em: {out_path} ({len(files) - falhas} processada(s), {falhas} com erro)")
+    return out_path
+
+# ======= MODO SERVIÇO (pasta monitorada / HTTP local) =======
+SERVICE_POLL_S = 2.0      # intervalo entre varreduras da pasta
+SERVICE_SETTLE_S = 3.0    # planilha precisa ficar este tempo sem mudar (cópia em andamento)
+SERVICE_HOST = "127.0.0.1"
+
+def _warm_worker():
+    # roda uma vez em cada processo do pool: engines carregados antes do 1º arquivo
+    for mod in ("python_calamine", "xlsxwriter", "pyarrow", "polars"):
+        try:
+            __import__(mod)
+        except ImportError:
+            pass
+
+class ReconciliationService:
+    """Processo residente: pool fixo de processos já aquecidos (pandas, openpyxl,
+    calamine) conciliando a fila de planilhas que chegam pela pasta ou pelo HTTP.
+    O relatório é gravado ao lado de cada planilha, como no modo normal."""
+
+    def __init__(self, workers=None, stream=False, chunk_size=None, use_cache=True, writer=None, skip_info=False,
+                 cross_day=CROSS_DAY_MATCHING, partition=PARTITION_BY, engine=None):
+        self.workers = workers or max(1, min(4, os.cpu_count() or 1))
+        self.args = (stream, chunk_size, use_cache, writer, skip_info, cross_day, PROFILE_ENABLED, partition,
+                     _resolve_engine(engine))
+        self.writer = _resolve_writer(writer)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        for _ in range(self.workers):   # sobe os processos agora, não no 1º arquivo
+            self.pool.submit(int)
+        self.lock = threading.Lock()
+        self.jobs = {}     # caminho -> estado do último processamento
+        self.vistos = {}   # caminho -> (mtime, tamanho) já enfileirado
+
+    def submit(self, path: Path, origem="pasta") -> dict:
+        key = str(Path(path).resolve())
+        with self.lock:
+            job = self.jobs.get(key)
+            if job and job["Status"] == "FILA":
+                return job
+            job = {"Arquivo": key, "Status": "FILA", "Origem": origem, "Enfileirado": time.strftime("%H:%M:%S"),
+                   "Segundos": None, "Diferenca": None, "Relatorio": "", "Log": "", "Erro": ""}
+            self.jobs[key] = job
+        t0 = time.perf_counter()
+        fut = self.pool.submit(_batch_worker, key, *self.args)
+        fut.add_done_callback(lambda f: self._done(key, f, t0))
+        print(f"[FILA] {Path(key).name} ({origem})")
+        return job
+
+    def _done(self, key, fut, t0):
+        try:
+            row, erro, log = fut.result()
+        except Exception as e:  # processo morto, pickling etc.
+            row, erro, log = None, f"{type(e).__name__}: {e}", ""
+        log_path = _save_batch_log(Path(key), log, erro)
+        with self.lock:
+            job = self.jobs[key]
+            job["Segundos"] = round(time.perf_counter() - t0, 2)
+            job["Log"] = log_path
+            if erro:
+                job.update(Status="ERRO", Erro=erro)
+            else:
+                job.update(Status="OK" if row["Fechou"] else "DIFERENCA", Diferenca=row["Diferenca"],
+                           Relatorio=row["Relatorio"])
+        detalhe = erro or f"diferença R$ {job['Diferenca']:.2f}"
+        print(f"[{job['Status']}] {Path(key).name}: {detalhe} ({job['Segundos']}s)")
+
+    def scan(self, pasta: Path):
+        agora = time.time()
+        for f in _batch_files(str(pasta)):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            assinatura = (st.st_mtime, st.st_size)
+            if self.vistos.get(f) == assinatura or agora - st.st_mtime < SERVICE_SETTLE_S:
+                continue
+            self.vistos[f] = assinatura
+            rel = _report_path(f, self.writer)
+            if rel.exists() and rel.stat().st_mtime >= st.st_mtime:
+                continue   # já conciliada (relatório mais novo que a planilha)
+            self.submit(f)
+
+    def status(self) -> list:
+        with self.lock:
+            return [dict(j) for j in self.jobs.values()]
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+def _http_handler(service: ReconciliationService, pasta):
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+
+    class Handler(BaseHTTPRequestHandler):
+        def _json(self, code, obj):
+            body = json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path != "/status":
+                return self._json(404, {"erro": "use GET /status ou POST /conciliar"})
+            self._json(200, service.status())
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/conciliar":
+                return self._json(404, {"erro": "use GET /status ou POST /conciliar"})
+            corpo = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                # {"planilha": "C:\\...\\razao.xlsx"}: arquivo já acessível pela máquina do serviço
+                try:
+                    path = Path(json.loads(corpo)["planilha"])
+                except Exception:
+                    return self._json(400, {"erro": 'corpo esperado: {"planilha": "caminho.xlsx"}'})
+            else:
+                # upload do .xlsx no corpo: ?nome=razao.xlsx, gravado na pasta do serviço
+                nome = Path(parse_qs(url.query).get("nome", [""])[0]).name
+                if pasta is None or not nome.lower().endswith((".xlsx", ".xlsm", ".xls")):
+                    return self._json(400, {"erro": "upload requer --servico PASTA e ?nome=arquivo.xlsx"})
+                path = Path(pasta) / nome
+                path.write_bytes(corpo)
+            if not path.is_file():
+                return self._json(404, {"erro": f"planilha não encontrada: {path}"})
+            self._json(202, service.submit(path, origem="http"))
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def run_service(pasta=None, porta=None, workers=None, **opts):
+    """Monitora `pasta` e/ou atende em http://127.0.0.1:<porta> até Ctrl+C."""
+    service = ReconciliationService(workers=workers, **opts)
+    httpd = None
+    if porta:
+        from http.server import ThreadingHTTPServer
+        httpd = ThreadingHTTPServer((SERVICE_HOST, porta), _http_handler(service, pasta))
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        print(f"[INFO] HTTP em http://{SERVICE_HOST}:{porta} (POST /conciliar, GET /status)")
+    if pasta:
+        pasta = Path(pasta)
+        pasta.mkdir(parents=True, exist_ok=True)
+        print(f"[INFO] Monitorando {pasta.resolve()} a cada {SERVICE_POLL_S:.0f}s")
+    print(f"[INFO] Serviço pronto com {service.workers} processo(s). Ctrl+C para encerrar.")
+    try:
+        while True:
+            if pasta:
+                service.scan(pasta)
+            time.sleep(SERVICE_POLL_S)
+    except KeyboardInterrupt:
+        print("\n[INFO] Encerrando serviço...")
+    finally:
+        if httpd:
+            httpd.shutdown()
+        service.close()
 
 # ======= ENTRADA =======
 def _pick_file_dialog():
@@ -377,8 +1554,53 @@ def _fallback_latest_xlsx():
                    key=lambda p: p.stat().st_mtime, reverse=True)
     return files[0] if files else None
 
+def _parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Conciliação da conta transitória (Débito x Crédito por dia/nota).")
+    ap.add_argument("planilha", nargs="?", help="caminho do .xlsx/.xls (se omitido: diálogo ou o mais recente da pasta)")
+    ap.add_argument("--lote", metavar="PASTA_OU_GLOB",
+                    help="concilia todas as planilhas da pasta/glob em paralelo e grava um índice")
+    ap.add_argument("--servico", metavar="PASTA",
+                    help="modo residente: concilia cada planilha nova que chegar na pasta")
+    ap.add_argument("--http", metavar="PORTA", type=int,
+                    help="modo residente: aceita planilhas em http://127.0.0.1:PORTA/conciliar")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="processos paralelos no --lote, entre partições ou no modo serviço (padrão: nº de CPUs)")
+    ap.add_argument("--particionar", metavar="COLUNA", default=PARTITION_BY,
+                    help="concilia cada lote/conta separadamente: 'lote', 'conta' ou o nome da coluna")
+    ap.add_argument("--stream", action="store_true",
+                    help="processa a planilha em chunks (memória limitada; só .xlsx/.xlsm)")
+    ap.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_ROWS,
+                    help=f"linhas por chunk no modo --stream (padrão {STREAM_CHUNK_ROWS})")
+    ap.add_argument("--writer", choices=WRITERS, default=REPORT_WRITER,
+                    help="formato do relatório: xlsx (openpyxl/xlsxwriter) ou pasta com parquet/csv")
+    ap.add_argument("--engine", choices=ENGINES, default=ENGINE,
+                    help="agregações por dia/nota: pandas ou polars (multithread, mesmos resultados)")
+    ap.add_argument("--sem-informativos", action="store_true",
+                    help=f"não grava as abas informativas ({', '.join(INFO_SHEETS)})")
+    ap.add_argument("--sem-pares-entre-dias", action="store_true",
+                    help="não liquida pares da mesma nota entre dias antes da busca por dia")
+    ap.add_argument("--profile", action="store_true",
+                    help="grava <planilha>_perfil.json com tempo/CPU/memória por etapa (ou CONTA_TRANSITORIA_PROFILE=1)")
+    ap.add_argument("--cprofile", action="store_true",
+                    help="além do perfil por etapa, grava o dump do cProfile em <planilha>_perfil.prof")
+    ap.add_argument("--no-cache", action="store_true",
+                    help=f"ignora o cache do razão parseado ({CACHE_DIR})")
+    return ap.parse_args(argv)
+
 def main():
-    xlsx = Path(sys.argv[1]) if len(sys.argv) >= 2 else None
+    args = _parse_args()
+    if args.servico or args.http:
+        run_service(args.servico, args.http, workers=args.workers, stream=args.stream, chunk_size=args.chunk_size,
+                    use_cache=not args.no_cache, writer=args.writer, skip_info=args.sem_informativos,
+                    cross_day=not args.sem_pares_entre_dias, partition=args.particionar, engine=args.engine)
+        return
+    if args.lote:
+        process_batch(args.lote, workers=args.workers, stream=args.stream, chunk_size=args.chunk_size,
+                      use_cache=not args.no_cache, writer=args.writer, skip_info=args.sem_informativos,
+                      cross_day=not args.sem_pares_entre_dias, profile=args.profile or PROFILE_ENABLED,
+                      partition=args.particionar, engine=args.engine)
+        return
+    xlsx = Path(args.planilha) if args.planilha else None
     if xlsx is None: xlsx = _pick_file_dialog()
     if xlsx is None: xlsx = _fallback_latest_xlsx()
     if xlsx is None or not xlsx.exists():
@@ -386,7 +1608,10 @@ def main():
               "ou selecione pelo diálogo ao dar duplo-clique no .py.")
         sys.exit(3)
     print(f"[INFO] Processando: {xlsx}")
-    process_file(xlsx)
+    process_file(xlsx, stream=args.stream, chunk_size=args.chunk_size, use_cache=not args.no_cache,
+                 writer=args.writer, skip_info=args.sem_informativos, cross_day=not args.sem_pares_entre_dias,
+                 profile=args.profile or PROFILE_ENABLED, cprofile=args.cprofile,
+                 partition=args.particionar, workers=args.workers, engine=args.engine)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,121 @@
+# gerador_razao.py
+# Gera razões sintéticos da conta transitória para testes de desempenho.
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+FORNECEDORES = ["ALFA COMERCIO LTDA", "BETA SERVICOS ME", "GAMA TRANSPORTES", "DELTA INSUMOS SA",
+                "EPSILON LOGISTICA", "ZETA MATERIAIS", "ETA DISTRIBUIDORA", "TETA ENGENHARIA"]
+COLUNAS = ["Data", "Lote", "Histórico", "Débito", "Crédito"]
+
+def _fmt_valor(cents: int, estilo: int):
+    # 0: número; 1: 1.234,56; 2: R$ 1.234,56; 3: 1234.56 (texto)
+    v = cents / 100
+    if estilo == 0:
+        return v
+    if estilo == 3:
+        return f"{v:.2f}"
+    br = f"{v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return br if estilo == 1 else f"R$ {br}"
+
+def gerar_razao(linhas=10000, dias=22, notas_por_dia=None, taxa_quebra=0.15, dias_desbalanceados=3,
+                formatos_baguncados=True, mes=None, seed=0) -> pd.DataFrame:
+    """Razão no formato da exportação do ERP: cada nota gera um débito e a baixa
+    a crédito no mesmo dia. Parte dos históricos é quebrada em linhas de
+    continuação (sem data) e alguns dias ficam desbalanceados de propósito."""
+    rng = np.random.default_rng(seed)
+    inicio = mes or datetime(2024, 5, 1)
+    if notas_por_dia:
+        n_notas = notas_por_dia * dias
+    else:
+        n_notas = max(1, int(linhas / (2 + taxa_quebra)))
+
+    nf = rng.choice(np.arange(1000, 1000 + max(10 * n_notas, 10000)), size=n_notas, replace=False)
+    dia = np.sort(rng.integers(0, dias, n_notas))
+    cents = rng.integers(100, 5_000_000, n_notas)
+    forn = rng.integers(0, len(FORNECEDORES), n_notas)
+    lote = rng.integers(1, 4, n_notas)
+    quebra = rng.random(n_notas) < taxa_quebra
+    estilo_d = rng.integers(0, 4, n_notas) if formatos_baguncados else np.zeros(n_notas, dtype=int)
+    estilo_c = rng.integers(0, 4, n_notas) if formatos_baguncados else np.zeros(n_notas, dtype=int)
+
+    # dias desbalanceados: 1..3 notas com baixa divergente ou sem baixa
+    cents_c = cents.copy()
+    sem_baixa = np.zeros(n_notas, dtype=bool)
+    for d in rng.choice(dias, size=min(dias_desbalanceados, dias), replace=False):
+        idx = np.flatnonzero(dia == d)
+        if not len(idx):
+            continue
+        for i in rng.choice(idx, size=min(len(idx), int(rng.integers(1, 4))), replace=False):
+            if rng.random() < 0.5:
+                sem_baixa[i] = True
+            else:
+                cents_c[i] += int(rng.integers(-5000, 5000)) or 1
+
+    nf, dia, cents, cents_c, forn, lote = (a.tolist() for a in (nf, dia, cents, cents_c, forn, lote))
+    rows = []
+    for i in range(n_notas):
+        data = inicio + timedelta(days=dia[i])
+        nome = FORNECEDORES[forn[i]]
+        if quebra[i]:
+            rows.append((data, lote[i], f"PAGTO NF {nf[i]}", _fmt_valor(cents[i], estilo_d[i]), None))
+            rows.append((None, None, f"{nome} REF. SERVICOS", None, None))
+        else:
+            rows.append((data, lote[i], f"PAGTO NF {nf[i]} {nome}", _fmt_valor(cents[i], estilo_d[i]), None))
+        if not sem_baixa[i]:
+            rows.append((data, lote[i], f"BAIXA NFE {nf[i]} {nome}", None, _fmt_valor(cents_c[i], estilo_c[i])))
+    return pd.DataFrame(rows, columns=COLUNAS)
+
+def salvar_xlsx(df: pd.DataFrame, path: Path, titulo="EMPRESA EXEMPLO LTDA - Razão Conta Transitória"):
+    """Grava como a exportação do ERP: linhas de título antes do cabeçalho."""
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+    path = Path(path)
+    if xlsxwriter is not None:
+        wb = xlsxwriter.Workbook(str(path), {"constant_memory": True})
+        ws = wb.add_worksheet("Razao")
+        f_date = wb.add_format({"num_format": "dd/mm/yyyy"})
+        ws.write(0, 0, titulo)
+        ws.write_row(2, 0, COLUNAS)
+        for r, row in enumerate(df.itertuples(index=False, name=None), start=3):
+            for c, v in enumerate(row):
+                if v is None or v is pd.NaT or (isinstance(v, float) and v != v):
+                    continue
+                if isinstance(v, datetime):
+                    ws.write_datetime(r, c, v, f_date)
+                else:
+                    ws.write(r, c, v)
+        wb.close()
+    else:
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Razao")
+        ws.append([titulo]); ws.append([]); ws.append(COLUNAS)
+        for row in df.itertuples(index=False, name=None):
+            ws.append([None if (v is pd.NaT or (isinstance(v, float) and v != v)) else v for v in row])
+        wb.save(path)
+    return path
+
+def main():
+    ap = argparse.ArgumentParser(description="Gera um razão sintético (.xlsx) da conta transitória.")
+    ap.add_argument("saida", help="arquivo .xlsx de saída")
+    ap.add_argument("--linhas", type=int, default=10000)
+    ap.add_argument("--dias", type=int, default=22)
+    ap.add_argument("--notas-por-dia", type=int, default=None, help="se informado, ignora --linhas")
+    ap.add_argument("--taxa-quebra", type=float, default=0.15, help="fração de históricos em 2 linhas")
+    ap.add_argument("--dias-desbalanceados", type=int, default=3)
+    ap.add_argument("--sem-formatos-baguncados", action="store_true", help="valores só numéricos")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    df = gerar_razao(args.linhas, args.dias, args.notas_por_dia, args.taxa_quebra, args.dias_desbalanceados,
+                     not args.sem_formatos_baguncados, seed=args.seed)
+    path = salvar_xlsx(df, Path(args.saida))
+    print(f"Razão sintético com {len(df)} linhas salvo em: {path}")
+
+if __name__ == "__main__":
+    main()
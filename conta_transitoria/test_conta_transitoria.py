@@ -0,0 +1,233 @@
+# test_conta_transitoria.py
+# Regressão do consolidate_history vetorizado contra a implementação linha a linha anterior
+# e da busca de responsáveis em centavos.
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import conta_transitoria as ct
+from gerador_razao import gerar_razao, salvar_xlsx
+
+def _consolidate_history_linha_a_linha(df, col_date, col_hist):
+    # implementação anterior (groupby-apply + df.at por âncora), mantida como referência
+    df = df.copy()
+    df["_has_date"] = ~df[col_date].isna()
+    df["_hist_add"] = (~df["_has_date"]) & df[col_hist].notna() & (df[col_hist].astype(str).str.strip() != "")
+    df["_anchor_idx"] = df.index.to_series().where(df["_has_date"]).ffill()
+    cont = df[df["_hist_add"]]
+    if not cont.empty:
+        add_text = cont.groupby("_anchor_idx")[col_hist].apply(lambda s: " | ".join(s.astype(str)))
+        for anchor, extra in add_text.items():
+            base = str(df.at[anchor, col_hist]) if pd.notna(df.at[anchor, col_hist]) else ""
+            sep = " | " if base and extra else ""
+            df.at[anchor, col_hist] = f"{base}{sep}{extra}"
+    df = df[df["_has_date"]].copy()
+    df.drop(columns=["_has_date", "_hist_add", "_anchor_idx"], inplace=True)
+    return df
+
+def _comparar(df):
+    esperado = _consolidate_history_linha_a_linha(df, "Data", "Histórico")
+    obtido = ct.consolidate_history(df, "Data", "Histórico")
+    pd.testing.assert_frame_equal(obtido, esperado)
+
+def test_historico_quebrado_em_varias_linhas():
+    df = pd.DataFrame({
+        "Data": [None, "01/05/2024", None, None, "02/05/2024", "03/05/2024", None, None, "04/05/2024", None],
+        "Histórico": ["ANTES DA PRIMEIRA DATA", "PAGTO NF 1001", "ALFA COMERCIO", "REF. SERVICOS",
+                      "BAIXA NFE 1001", None, "SO CONTINUACAO", "   ", 12345, 678],
+        "Débito": [None, 10.0, None, None, None, 5.0, None, None, 7.0, None],
+        "Crédito": [None, None, None, None, 10.0, None, None, None, None, None],
+    })
+    obtido = ct.consolidate_history(df, "Data", "Histórico")
+    assert obtido["Histórico"].tolist() == ["PAGTO NF 1001 | ALFA COMERCIO | REF. SERVICOS", "BAIXA NFE 1001",
+                                            "SO CONTINUACAO", "12345 | 678"]
+    _comparar(df)
+
+def test_indice_nao_padrao():
+    # read_with_header_detection devolve o frame sem as linhas de título (índice deslocado)
+    df = pd.DataFrame({"Data": ["01/05/2024", None, "02/05/2024", None],
+                       "Histórico": ["PAGTO NF 2002", "BETA SERVICOS", "", "GAMA"]},
+                      index=range(3, 7))
+    _comparar(df)
+
+def test_sem_continuacoes():
+    df = pd.DataFrame({"Data": ["01/05/2024", "02/05/2024"], "Histórico": ["PAGTO NF 1", "BAIXA NF 1"]})
+    _comparar(df)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_razao_sintetico(seed):
+    df = gerar_razao(2000, taxa_quebra=0.3, seed=seed)
+    # continuações com mais de uma linha e históricos vazios/NaN nas âncoras
+    rng = np.random.default_rng(seed)
+    extras = df[df["Data"].isna()].sample(frac=0.5, random_state=seed)
+    df = pd.concat([df, extras.assign(**{"Histórico": "LINHA EXTRA"})]).sort_index(kind="stable").reset_index(drop=True)
+    ancoras = np.flatnonzero(df["Data"].notna().to_numpy())
+    df.loc[rng.choice(ancoras, size=20, replace=False), "Histórico"] = None
+    _comparar(df)
+
+def _selecionar(centavos, alvo, **kwargs):
+    por_dia_nota = pd.DataFrame({"Dia": "d", "NotaID": [f"N{i}" for i in range(len(centavos))],
+                                 "Diferenca": centavos})
+    return ct.pick_responsible_sets(por_dia_nota, pd.DataFrame({"Dia": ["d"], "Diferenca": [alvo]}), **kwargs)["d"]
+
+def test_soma_exata_antes_da_tolerancia():
+    # N0+N1 fica 1 centavo acima do alvo e vem antes de N2+N3 (exata) na ordem das combinações
+    assert _selecionar([1000, 501, 900, 600], 1500) == {"N2", "N3"}
+
+def test_tolerancia_de_um_centavo():
+    assert _selecionar([1000, 501, 7], 1500) == {"N0", "N1"}
+
+def test_menor_conjunto_primeiro():
+    # par a 1 centavo vence trio exato: a tolerância vale dentro de cada tamanho
+    assert _selecionar([1000, 501, 702, 299, 499], 1500) == {"N0", "N1"}
+
+def test_indice_por_valor_igual_ao_de_pares(monkeypatch):
+    # acima de PAIR_INDEX_MAX_NOTES a busca troca de índice: mesma combinação escolhida
+    rng = np.random.default_rng(7)
+    for _ in range(100):
+        centavos = rng.integers(-5000, 5000, size=rng.integers(5, 25)).tolist()
+        alvo = int(sum(rng.choice(centavos, size=rng.integers(1, 5), replace=False))) + int(rng.choice([0, 0, 1, -1]))
+        monkeypatch.setattr(ct, "PAIR_INDEX_MAX_NOTES", 500)
+        pares = _selecionar(centavos, alvo)
+        monkeypatch.setattr(ct, "PAIR_INDEX_MAX_NOTES", 0)
+        assert _selecionar(centavos, alvo) == pares
+
+def test_busca_limitada_pelo_tempo():
+    # muitas notas e nenhuma combinação: para no orçamento e cai na aproximação
+    centavos = (np.arange(1, 3001) * 200).tolist()
+    inicio = time.perf_counter()
+    assert _selecionar(centavos, 12345677, time_budget=0.2)
+    assert time.perf_counter() - inicio < 2
+
+def test_rotulos_de_particao_sem_repetir_maiusculas():
+    # nomes de aba do Excel e arquivos no Windows não distinguem maiúsculas
+    assert ct._partition_labels(["a", "A", "b", "B", "b"]) == ["a", "A~2", "b", "B~2", "b~3"]
+
+def test_reconcile_nao_usa_o_console(capsys):
+    # biblioteca: mensagens vão para `log`, sem trocar sys.stdout do processo
+    mensagens = []
+    ct.reconcile(gerar_razao(300, seed=1), log=lambda *a, **k: mensagens.append(" ".join(map(str, a))))
+    assert capsys.readouterr().out == ""
+    assert any("Colunas mapeadas" in m for m in mensagens)
+    ct.reconcile(gerar_razao(300, seed=1))
+    assert capsys.readouterr().out == ""
+
+def _razao_com_casos_de_borda(seed=0):
+    # valores vazios/inválidos num dos lados e históricos com mais de uma nota
+    df = gerar_razao(1500, dias_desbalanceados=5, seed=seed)
+    extras = pd.DataFrame({
+        "Data": [datetime(2024, 5, 2), datetime(2024, 5, 2), datetime(2024, 5, 3), datetime(2024, 5, 3),
+                 datetime(2024, 5, 4), datetime(2024, 5, 4)],
+        "Lote": [1, 1, 2, 2, 3, 3],
+        "Histórico": ["PAGTO NF 777 / 778 / 779", "BAIXA NFE 777 NF 778", "PAGTO NF 880", "BAIXA NFE 880",
+                      "AJUSTE SEM NOTA", "PAGTO NF 990 E 991"],
+        "Débito": ["1.234,56", "", "abc", None, "  ", "R$ 10,00"],
+        "Crédito": [None, "1.234,50", "12,00", "xyz", "5,00", ""],
+    })
+    return pd.concat([df, extras], ignore_index=True)
+
+@pytest.mark.parametrize("seed", range(3))
+def test_engine_polars_igual_ao_pandas(seed):
+    pytest.importorskip("polars")
+    df_raw = _razao_com_casos_de_borda(seed)
+    colmap = ct.normalize_cols(df_raw, log=lambda *a, **k: None)
+    df = ct.prepare_ledger(df_raw, colmap)
+    for esperado, obtido in zip(ct._aggregate(df), ct._aggregate_polars(df)):
+        pd.testing.assert_frame_equal(obtido.reset_index(drop=True), esperado.reset_index(drop=True))
+
+    por_pandas = ct.reconcile(df_raw, engine="pandas").sheets()
+    por_polars = ct.reconcile(df_raw, engine="polars").sheets()
+    assert list(por_polars) == list(por_pandas)
+    for nome in por_pandas:
+        pd.testing.assert_frame_equal(por_polars[nome], por_pandas[nome], obj=nome)
+
+def _diffs(*linhas):
+    # (dia do mês, NotaID, diferença em centavos)
+    return pd.DataFrame([(date(2024, 5, d), n, v) for d, n, v in linhas], columns=["Dia", "NotaID", "Diferenca"])
+
+def test_par_entre_dias_exato():
+    pares = ct.match_cross_day(_diffs((3, "100", 5000), (5, "100", -5000)))
+    assert pares.to_dict("records") == [{"NotaID": "100", "Dia": date(2024, 5, 3), "Diferenca": 5000,
+                                         "Dia_Contrapartida": date(2024, 5, 5), "Diferenca_Contrapartida": -5000,
+                                         "Dias_Entre": 2}]
+
+def test_par_fora_da_tolerancia_fica_aberto():
+    # até TOL_CENTS casa; 2 centavos já não; SEM_NOTA nunca casa
+    assert len(ct.match_cross_day(_diffs((3, "100", 5000), (5, "100", -4999)))) == 1
+    assert ct.match_cross_day(_diffs((3, "100", 5000), (5, "100", -4998))).empty
+    assert ct.match_cross_day(_diffs((3, "SEM_NOTA", 5000), (5, "SEM_NOTA", -5000))).empty
+    assert ct.match_cross_day(_diffs((3, "100", 5000), (5, "200", -5000))).empty
+
+def test_par_ambiguo_usa_o_item_aberto_mais_antigo():
+    pares = ct.match_cross_day(_diffs((2, "100", 5001), (3, "100", 5000), (6, "100", -5000), (7, "100", -5000)))
+    assert [(p.Dia.day, p.Dia_Contrapartida.day) for p in pares.itertuples()] == [(2, 6), (3, 7)]
+
+def test_notas_liquidadas_saem_da_busca_por_dia():
+    diffs = _diffs((3, "100", 5000), (3, "300", 700), (5, "100", -5000))
+    dias = pd.DataFrame({"Dia": [date(2024, 5, 3), date(2024, 5, 5)], "Diferenca": [5700, -5000]})
+    restantes, dias_busca, liquidadas = ct._settle_cross_day(ct.match_cross_day(diffs), diffs, dias)
+    assert restantes[["Dia", "NotaID"]].values.tolist() == [[date(2024, 5, 3), "300"]]
+    # dia 5 explicado pelo par: sai da busca; dia 3 busca só o que sobrou
+    assert dias_busca.to_dict("records") == [{"Dia": date(2024, 5, 3), "Diferenca": 700}]
+    assert liquidadas == {date(2024, 5, 3): {"100"}, date(2024, 5, 5): {"100"}}
+
+def test_streaming_igual_ao_normal(tmp_path):
+    chunk = 7
+    path = tmp_path / "razao.xlsx"
+    salvar_xlsx(gerar_razao(300, taxa_quebra=0.5, seed=11), path)
+    relatorio = tmp_path / "razao_relatorio.xlsx"
+    sem_log = lambda *a, **k: None
+    # alguma continuação de histórico abre um chunk (nota dividida entre chunks)
+    assert any(c["Data"].isna().iloc[0] for c in list(ct._iter_raw_chunks(path, chunk, sem_log))[1:])
+
+    ct.process_file(path, use_cache=False, log=sem_log)
+    normal = pd.read_excel(relatorio, sheet_name=None)
+    ct.process_file(path, stream=True, chunk_size=chunk, use_cache=False, log=sem_log)
+    streaming = pd.read_excel(relatorio, sheet_name=None)
+    assert list(streaming) == list(normal)
+    for nome in normal:
+        pd.testing.assert_frame_equal(streaming[nome], normal[nome], obj=nome)
+
+VALORES = ["1.234,56", "1234.56", "1,5", "R$ 1.234,56", "-1.234,56", "(1.234,56)", "1.234.567,89", "1,234.56",
+           "  98,70 ", "", "   ", None, np.nan, 12.5, 1000, 0, "abc", "-", "1.2.3", "R$ -0,01"]
+
+def test_to_number_series_igual_ao_escalar():
+    col = pd.Series(VALORES, dtype=object)
+    esperado = col.apply(ct.to_number).astype("Float64")
+    pd.testing.assert_series_equal(ct.to_number_series(col), esperado)
+
+def test_to_cents_series_igual_ao_escalar():
+    col = pd.Series(VALORES, dtype=object)
+    esperado = [pd.NA if pd.isna(v := ct.to_number(x)) else int(round(v * 100)) for x in VALORES]
+    assert ct.to_cents_series(col).tolist() == esperado
+
+@pytest.mark.parametrize("datas", [
+    ["03/05/2024", "3/5/2024", "31/12/2024", "", None, "abc", "31/02/2024"],
+    ["03/05/2024 14:30:00", "31/12/2024 23:59:59", None, "abc"],
+    [datetime(2024, 5, 3, 9, 15), pd.Timestamp("2024-05-04"), None],
+])
+def test_parse_date_igual_a_implementacao_anterior(datas):
+    # implementação anterior: pd.to_datetime(dayfirst=True) na coluna inteira
+    col = pd.Series(datas, dtype=object)
+    esperado = pd.to_datetime(col, errors="coerce", dayfirst=True).astype("datetime64[ns]")
+    pd.testing.assert_series_equal(ct.parse_date(col), esperado)
+
+def _datas(*valores):
+    return pd.Series([pd.Timestamp(v) if v else pd.NaT for v in valores], dtype="datetime64[ns]")
+
+def test_parse_date_iso():
+    # aqui a implementação anterior divergia: com dayfirst=True lia 2024-05-03 como 5 de março
+    col = pd.Series(["2024-05-03", "2024-12-31", "2024-05-03 08:00:00", "", None, "2024-02-31"], dtype=object)
+    pd.testing.assert_series_equal(ct.parse_date(col),
+                                   _datas("2024-05-03", "2024-12-31", "2024-05-03 08:00", None, None, None))
+
+def test_parse_date_formatos_misturados():
+    # na mesma coluna: dd/mm/aaaa, ISO e datetime, cada um no seu formato
+    col = pd.Series(["03/05/2024", "2024-05-04", "05/05/2024 10:00:00", datetime(2024, 5, 6), "", None], dtype=object)
+    pd.testing.assert_series_equal(ct.parse_date(col),
+                                   _datas("2024-05-03", "2024-05-04", "2024-05-05 10:00", "2024-05-06", None, None))
+    iso = pd.Series(pd.to_datetime(["2024-05-03", "2024-05-04"]))
+    assert ct.parse_date(iso) is iso
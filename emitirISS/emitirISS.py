@@ -1,22 +1,41 @@
 import os
+import io
 import csv
 import time
+import sys
+import tempfile
 from datetime import datetime
 from playwright.sync_api import sync_playwright
 import pyautogui
 
+# código comum aos scripts do ESNFS fica na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from esnfs_comum import EnvioCompartilhamento, MedidorNavegacao
+
 # Diretório base dos downloads
 BASE_DOWNLOAD_DIR = r"\\192.0.0.251\arquivos\XML PREFEITURA"
 
+# ======= ENVIO PARA O COMPARTILHAMENTO (write-behind) =======
+# PDFs e log vão primeiro para o spool local; threads copiam para o compartilhamento
+SPOOL_DIR = os.environ.get("ISS_SPOOL", os.path.join(tempfile.gettempdir(), "iss_spool"))
+ENVIO_WORKERS = int(os.environ.get("ISS_ENVIO_WORKERS", "4"))
+envio = EnvioCompartilhamento(SPOOL_DIR, ENVIO_WORKERS)
+
+# ======= PERFIL DE DESEMPENHO DO NAVEGADOR =======
+# Continua visível e com o tamanho de janela padrão: o download do PDF e o aviso
+# são clicados com pyautogui por coordenada de tela. Só corta o que não é usado.
+# ISS_PERFIL=completo carrega tudo (para comparar a medição).
+PERFIL_RAPIDO = os.environ.get("ISS_PERFIL", "rapido") != "completo"
+medidor = MedidorNavegacao(bloquear=PERFIL_RAPIDO)
+
 # Lista de log dos prestadores
 log_prestadores = []
 
-# Utilitário: monta o caminho final do PDF
+# Utilitário: monta o caminho final do PDF (a pasta é criada pelo envio)
 def montar_caminho_download(nome_prestador, mes, ano):
     nome_limpo = nome_prestador.split(" - ", 1)[1] if " - " in nome_prestador else nome_prestador
     pasta_cliente = os.path.join(BASE_DOWNLOAD_DIR, nome_limpo.strip())
     pasta_mes_ano = os.path.join(pasta_cliente, f"{str(mes).zfill(2)}.{ano}")
-    os.makedirs(pasta_mes_ano, exist_ok=True)
     nome_arquivo_pdf = f"ISS {nome_limpo}.pdf"
     caminho_final_pdf = os.path.join(pasta_mes_ano, nome_arquivo_pdf)
     return caminho_final_pdf
@@ -24,12 +43,13 @@ def montar_caminho_download(nome_prestador, mes, ano):
 # Salva log CSV
 def salvar_log_em_csv():
     caminho_csv = os.path.join(BASE_DOWNLOAD_DIR, "log_emissao_guias.csv")
-    with open(caminho_csv, mode="w", newline="", encoding="utf-8") as arquivo_csv:
-        campos = ["Prestador", "Pesquisa", "Clique Emitir", "Download Guia", "Mensagem de Erro"]
-        writer = csv.DictWriter(arquivo_csv, fieldnames=campos)
-        writer.writeheader()
-        for linha in log_prestadores:
-            writer.writerow(linha)
+    arquivo_csv = io.StringIO(newline="")
+    campos = ["Prestador", "Pesquisa", "Clique Emitir", "Download Guia", "Mensagem de Erro"]
+    writer = csv.DictWriter(arquivo_csv, fieldnames=campos)
+    writer.writeheader()
+    for linha in log_prestadores:
+        writer.writerow(linha)
+    envio.gravar(caminho_csv, arquivo_csv.getvalue().encode("utf-8"))
     print(f"\n📝 Log salvo em: {caminho_csv}")
 
 # Emite todas as guias disponíveis para um prestador
@@ -102,7 +122,10 @@ def emitir_guias(pagina, contexto, nome_prestador, mes, ano):
 
                     download_pdf = download_info.value
                     caminho_final_pdf = montar_caminho_download(nome_prestador, mes, ano)
-                    download_pdf.save_as(caminho_final_pdf)
+                    # guias do mesmo prestador vão para o mesmo arquivo: a última baixada vence
+                    versao, local_pdf = envio.reservar(caminho_final_pdf)
+                    download_pdf.save_as(local_pdf)
+                    envio.enviar(caminho_final_pdf, versao, local_pdf)
                     print(f"✅ PDF salvo em:\n{caminho_final_pdf}")
                     registro["Download Guia"] = "OK"
 
@@ -207,8 +230,9 @@ def processar_prestadores(pagina, contexto):
 # Fluxo principal
 def main():
     with sync_playwright() as p:
-        navegador = p.chromium.launch(channel="chrome", headless=False)
+        navegador = p.chromium.launch(channel="chrome", headless=False, args=medidor.argumentos())
         contexto = navegador.new_context(accept_downloads=True)
+        medidor.acompanhar(contexto)
         pagina = contexto.new_page()
 
         pagina.goto("https://www.esnfs.com.br/?e=35")
@@ -230,6 +254,8 @@ def main():
 
         processar_prestadores(pagina, contexto)
         salvar_log_em_csv()
+        medidor.relatorio(os.path.join(BASE_DOWNLOAD_DIR, "navegacoes_emissao_guias.csv"), envio)
+        envio.drenar()
         input("\n🛑 Pressione ENTER para encerrar manualmente...")
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+# esnfs_comum.py
+# Código comum aos scripts do portal ESNFS (notaServico/notas-servico.py e emitirISS/emitirISS.py).
+import io
+import os
+import csv
+import time
+import shutil
+import threading
+import statistics
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+# ======= ENVIO PARA O COMPARTILHAMENTO (write-behind) =======
+ENVIO_TENTATIVAS = 5
+
+class EnvioCompartilhamento:
+    """Fila de cópias spool -> compartilhamento. Cada gravação vira um arquivo
+    próprio no spool (versão); só a mais recente de cada destino é copiada,
+    uma cópia por destino de cada vez, via arquivo .parcial + os.replace.
+    Pastas já criadas ficam em cache; falhas ficam no spool para reenvio manual."""
+
+    def __init__(self, spool, workers=4, tentativas=ENVIO_TENTATIVAS):
+        self.spool = spool
+        self.tentativas = tentativas
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="envio")
+        self.lock = threading.Lock()
+        self.pendentes = {}     # destino -> (versão, arquivo no spool)
+        self.travas = {}        # destino -> lock (uma cópia por destino de cada vez)
+        self.pastas = set()
+        self.futuros = []
+        self.falhas = []
+        self.versao = 0
+        os.makedirs(spool, exist_ok=True)
+
+    def reservar(self, destino):
+        """(versão, caminho no spool) para quem grava o arquivo por conta própria
+        (ex.: download.save_as); depois chamar enviar()."""
+        with self.lock:
+            self.versao += 1
+            versao = self.versao
+        return versao, os.path.join(self.spool, f"{versao:07d}_{os.path.basename(destino)}")
+
+    def enviar(self, destino, versao, local):
+        with self.lock:
+            # a versão reservada por último vence, mesmo que enviada fora de ordem
+            if versao > self.pendentes.get(destino, (0,))[0]:
+                self.pendentes[destino] = (versao, local)
+            self.travas.setdefault(destino, threading.Lock())
+            self.futuros.append(self.pool.submit(self._copiar, destino, versao, local))
+
+    def gravar(self, destino, conteudo):
+        versao, local = self.reservar(destino)
+        with open(local, "wb") as f:
+            f.write(conteudo)
+        self.enviar(destino, versao, local)
+
+    def _candidatos(self, destino):
+        # conteúdo mais recente: o do spool se ainda não foi enviado; se a cópia
+        # terminar no meio da leitura, o do compartilhamento já é o mesmo
+        with self.lock:
+            local = self.pendentes.get(destino, (None, destino))[1]
+        return (local, destino) if local != destino else (destino,)
+
+    def ler(self, destino):
+        for caminho in self._candidatos(destino):
+            try:
+                with open(caminho, "rb") as f:
+                    return f.read()
+            except OSError:
+                continue
+        return None
+
+    def tamanho(self, destino):
+        for caminho in self._candidatos(destino):
+            try:
+                return os.path.getsize(caminho)
+            except OSError:
+                continue
+        return None
+
+    def _criar_pasta(self, pasta):
+        if pasta not in self.pastas:
+            os.makedirs(pasta, exist_ok=True)
+            self.pastas.add(pasta)
+
+    def _copiar(self, destino, versao, local):
+        with self.travas[destino]:
+            for tentativa in range(1, self.tentativas + 1):
+                with self.lock:
+                    atual = self.pendentes.get(destino, (None,))[0]
+                if atual != versao:
+                    os.remove(local)  # já existe versão mais nova na fila
+                    return
+                try:
+                    self._criar_pasta(os.path.dirname(destino))
+                    shutil.copyfile(local, destino + ".parcial")
+                    os.replace(destino + ".parcial", destino)
+                    with self.lock:
+                        if self.pendentes.get(destino, (None,))[0] == versao:
+                            del self.pendentes[destino]
+                    os.remove(local)
+                    return
+                except OSError as e:
+                    self.pastas.discard(os.path.dirname(destino))
+                    print(f"⚠️ Envio de {os.path.basename(destino)} falhou ({tentativa}/{self.tentativas}): {e}")
+                    time.sleep(min(2 ** tentativa, 30))
+            self.falhas.append((destino, local))  # fica no spool para reenvio manual
+
+    def drenar(self):
+        """Espera a fila esvaziar. Chamado no fim da execução."""
+        with self.lock:
+            futuros, self.futuros = self.futuros, []
+        if futuros:
+            print(f"\n📤 Aguardando envio de {len(futuros)} arquivo(s) para o compartilhamento...")
+        for fut in futuros:
+            fut.result()
+        for destino, local in self.falhas:
+            print(f"❌ Não enviado: {destino} (cópia local em {local})")
+        return not self.falhas
+
+# ======= PERFIL DE DESEMPENHO DO NAVEGADOR =======
+# O corte é feito pelo próprio Chromium (argumentos de inicialização), não por
+# context.route: com rota o Playwright desliga o cache HTTP e o CSS/JS do portal
+# seria baixado de novo a cada tela. Imagens não são usadas pela automação; fontes
+# e CSS do portal ficam: os ícones clicados (fa-file-pdf-o, fa-barcode) são glifos
+# da fonte do Font Awesome.
+# terceiros: analytics e fontes web do Google (só texto), resolvidos para "não existe"
+HOSTS_BLOQUEADOS = ("google-analytics.com", "googletagmanager.com", "doubleclick.net", "hotjar.com",
+                    "facebook.net", "fonts.googleapis.com", "fonts.gstatic.com")
+
+def _host_bloqueado(url):
+    host = urlsplit(url).hostname or ""
+    return any(host == h or host.endswith("." + h) for h in HOSTS_BLOQUEADOS)
+
+class MedidorNavegacao:
+    """Bytes (content-length das respostas; respostas sem o cabeçalho contam 0) e
+    tempo até o load de cada navegação do frame principal (os XHR seguintes contam
+    para a navegação corrente) e requisições a hosts bloqueados."""
+
+    def __init__(self, bloquear=True):
+        self.bloquear = bloquear
+        self.navegacoes = []
+        self.bloqueadas = 0
+        self.lock = threading.Lock()
+
+    def argumentos(self):
+        """args do chromium.launch para o perfil rápido."""
+        if not self.bloquear:
+            return []
+        regras = ", ".join(f"MAP {h} ~NOTFOUND, MAP *.{h} ~NOTFOUND" for h in HOSTS_BLOQUEADOS)
+        return ["--blink-settings=imagesEnabled=false", f"--host-resolver-rules={regras}"]
+
+    def acompanhar(self, contexto):
+        contexto.on("page", self._pagina)
+
+    def _pagina(self, pagina):
+        estado = {"nav": None}
+
+        def requisicao(req):
+            if req.is_navigation_request() and req.frame == pagina.main_frame:
+                estado["nav"] = {"URL": req.url.split("?", 1)[0], "Worker": threading.current_thread().name,
+                                 "Bytes": 0, "Requisicoes": 0, "Carga (ms)": None, "inicio": time.perf_counter()}
+                with self.lock:
+                    self.navegacoes.append(estado["nav"])
+
+        def resposta(resp):
+            # headers provisórios: já vêm no evento, sem ida e volta ao navegador
+            if estado["nav"] is not None:
+                tamanho = resp.headers.get("content-length", "")
+                estado["nav"]["Bytes"] += int(tamanho) if tamanho.isdigit() else 0
+                estado["nav"]["Requisicoes"] += 1
+
+        def falhou(req):
+            if self.bloquear and _host_bloqueado(req.url):
+                with self.lock:
+                    self.bloqueadas += 1
+
+        def carregou():
+            nav = estado["nav"]
+            if nav is not None and nav["Carga (ms)"] is None:
+                nav["Carga (ms)"] = round((time.perf_counter() - nav["inicio"]) * 1000)
+
+        pagina.on("request", requisicao)
+        pagina.on("response", resposta)
+        pagina.on("requestfailed", falhou)
+        pagina.on("load", carregou)
+
+    def relatorio(self, caminho_csv, envio):
+        with self.lock:
+            navegacoes = list(self.navegacoes)
+        if not navegacoes:
+            return
+        arquivo_csv = io.StringIO(newline="")
+        writer = csv.DictWriter(arquivo_csv, fieldnames=["URL", "Worker", "Bytes", "Requisicoes", "Carga (ms)"],
+                                extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(navegacoes)
+        envio.gravar(caminho_csv, arquivo_csv.getvalue().encode("utf-8"))
+        total = sum(n["Bytes"] for n in navegacoes)
+        cargas = [n["Carga (ms)"] for n in navegacoes if n["Carga (ms)"] is not None]
+        print(f"\n🌐 {len(navegacoes)} navegação(ões): {total / 1048576:.1f} MB recebidos "
+              f"(média {total / len(navegacoes) / 1024:.0f} KB), carga média "
+              f"{statistics.mean(cargas) if cargas else 0:.0f} ms, {self.bloqueadas} requisição(ões) bloqueada(s) "
+              f"(perfil {'rápido' if self.bloquear else 'completo'})")
+        print(f"📝 Navegações salvas em: {caminho_csv}")
@@ -1,17 +1,406 @@
 import os
+import re
+import io
+import csv
+import json
+import sys
+import hashlib
+import tempfile
 import time
+import queue
+import argparse
+import threading
+import statistics
 from datetime import datetime
 import subprocess
-from playwright.sync_api import sync_playwright
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+
+# código comum aos scripts do ESNFS fica na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from esnfs_comum import EnvioCompartilhamento, MedidorNavegacao
 
 # Caminho base dos downloads
 base_download_dir = r"\\192.0.0.251\arquivos\XML PREFEITURA"
 
+# ======= ENVIO PARA O COMPARTILHAMENTO (write-behind) =======
+# o navegador grava no spool local e segue; threads copiam para o compartilhamento
+SPOOL_DIR = os.environ.get("NFS_SPOOL", os.path.join(tempfile.gettempdir(), "nfs_spool"))
+ENVIO_WORKERS = int(os.environ.get("NFS_ENVIO_WORKERS", "4"))
+envio = EnvioCompartilhamento(SPOOL_DIR, ENVIO_WORKERS)
+
+# ======= ESPERAS POR CONDIÇÃO (em vez de sleeps fixos) =======
+TIMEOUT_PADRAO = 15000     # ms: limite comum para elementos, respostas e navegações
+TIMEOUT_DOWNLOAD = 30000   # ms: exportação de XML/PDF
+# NFS_ESPERAS_FIXAS=1 volta aos atrasos fixos antigos (para comparar o tempo por prestador)
+ESPERAS_FIXAS = os.environ.get("NFS_ESPERAS_FIXAS", "") == "1"
+
+def pausa_legada(pagina, ms):
+    # só no modo de esperas fixas: reproduz o atraso antigo
+    if ESPERAS_FIXAS:
+        pagina.wait_for_timeout(ms)
+
+def aguardar_ocioso(pagina, legado=500):
+    """Documento carregado e rede sem requisições pendentes (ex.: após Limpar)."""
+    if ESPERAS_FIXAS:
+        return pagina.wait_for_timeout(legado)
+    pagina.wait_for_load_state("domcontentloaded")
+    try:
+        pagina.wait_for_load_state("networkidle")
+    except PlaywrightTimeoutError:
+        pass
+
+TIPOS_RESPOSTA = ("document", "xhr", "fetch")
+
+# marca o elemento já na tela: qualquer alteração no conteúdo liga el.__nfsAlterado
+OBSERVAR_ALTERACAO = """el => {
+    el.__nfsAlterado = false;
+    const obs = new MutationObserver(() => { el.__nfsAlterado = true; obs.disconnect(); });
+    obs.observe(el, {childList: true, subtree: true, characterData: true, attributes: true});
+}"""
+
+def filtro_do_formulario(botao):
+    # resposta ao envio do formulário do botão (action/method, ou formaction/formmethod
+    # do próprio botão); botão fora de formulário: qualquer documento/XHR
+    envio = botao.first.evaluate("""b => {
+        const f = b.form || b.closest('form');
+        if (!f) return null;
+        const acao = b.getAttribute('formaction') || f.getAttribute('action') || location.href;
+        const metodo = b.getAttribute('formmethod') || f.getAttribute('method') || 'get';
+        return [new URL(acao, location.href).href.split('?')[0], metodo.toUpperCase()];
+    }""")
+    if envio is None:
+        return lambda r: r.request.resource_type in TIPOS_RESPOSTA
+    url, metodo = envio
+    return lambda r: (r.request.resource_type in TIPOS_RESPOSTA and r.request.method == metodo
+                      and r.url.split("?", 1)[0] == url)
+
+def clicar_e_aguardar(pagina, alvo, pronto=None, legado=2000, renovar=False):
+    """Clica e espera a resposta do portal à ação: a página nova (ou o XHR)
+    disparada pelo clique e, se informado, o elemento `pronto` visível.
+    `renovar` (pesquisas): a resposta tem de ser a do formulário do botão e um
+    `pronto` que já estava na tela (tabela da pesquisa anterior) precisa sair da
+    tela ou ser alterado antes de valer como pronto."""
+    botao = pagina.locator(alvo) if isinstance(alvo, str) else alvo
+    if ESPERAS_FIXAS:
+        botao.click()
+        pagina.wait_for_timeout(legado)
+        return None
+    if isinstance(pronto, str):
+        pronto = pagina.locator(pronto)
+    antigo = None
+    if renovar and pronto is not None and pronto.count():
+        antigo = pronto.first.element_handle()
+        antigo.evaluate(OBSERVAR_ALTERACAO)
+    filtro = filtro_do_formulario(botao) if renovar else (lambda r: r.request.resource_type in TIPOS_RESPOSTA)
+    pagina.evaluate("window.__aguardandoResposta = true")
+    with pagina.expect_response(filtro) as resposta:
+        botao.click()
+    if resposta.value.request.resource_type == "document":
+        # o marcador some quando o documento antigo é substituído
+        pagina.wait_for_function("() => !window.__aguardandoResposta")
+        pagina.wait_for_load_state("domcontentloaded")
+    else:
+        resposta.value.finished()
+    if antigo is not None:
+        pagina.wait_for_function("el => !el.isConnected || el.__nfsAlterado", arg=antigo)
+    if pronto is not None:
+        pronto.first.wait_for(state="visible")
+    return resposta.value
+
+def aguardar_opcoes(pagina, nome_select):
+    # select de prestadores é preenchido depois do carregamento da tela
+    pagina.wait_for_function(
+        """(nome) => {
+            const select = document.querySelector(`select[name="${nome}"]`);
+            return select && select.options.length > 1;
+        }""",
+        arg=nome_select,
+    )
+
+def abrir_tela(pagina, menu, item, nome_select, legado=1000):
+    # menu superior -> item; pronta quando o select de prestadores tiver opções
+    pagina.click(f"text={menu}")
+    clicar_e_aguardar(pagina, f"text={item}", pronto=f'select[name="{nome_select}"]', legado=legado)
+    aguardar_opcoes(pagina, nome_select)
+
+def resultado_pesquisa(pagina, tabela="table#tabelaDinamica"):
+    # a pesquisa terminou quando aparece a tabela de resultados ou o aviso de vazio
+    return pagina.locator("text=Não há registros").or_(pagina.locator(tabela))
+
+def rotulo_competencias(competencias):
+    # um mês: MM.AAAA; intervalo: MM.AAAA_a_MM.AAAA
+    rotulos = [f"{str(mes).zfill(2)}.{ano}" for mes, ano, _ in (competencias[0], competencias[-1])]
+    return "_a_".join(dict.fromkeys(rotulos))
+
+def salvar_tempos_em_csv(tempos, competencias):
+    caminho_csv = os.path.join(base_download_dir, f"tempos_prestadores_{rotulo_competencias(competencias)}.csv")
+    arquivo_csv = io.StringIO(newline="")
+    campos = ["Prestador", "Competencia", "Segundos", "Emitida", "Recebida", "Esperas", "Worker", "Via", "Erro"]
+    writer = csv.DictWriter(arquivo_csv, fieldnames=campos)
+    writer.writeheader()
+    writer.writerows(tempos)
+    envio.gravar(caminho_csv, arquivo_csv.getvalue().encode("utf-8"))
+    segundos = [t["Segundos"] for t in tempos if t["Segundos"] is not None]
+    if segundos:
+        print(f"\n⏱️ {len(segundos)} prestador(es)/competência(s): total {sum(segundos):.0f}s, "
+              f"média {statistics.mean(segundos):.1f}s, mediana {statistics.median(segundos):.1f}s "
+              f"(esperas {'fixas' if ESPERAS_FIXAS else 'por condição'})")
+    print(f"📝 Tempos salvos em: {caminho_csv}")
+
+def salvar_comparacao_esperas(tempos, competencias):
+    # antes (esperas fixas) x depois (por condição) para cada prestador/competência
+    pares = {}
+    for t in tempos:
+        if t["Esperas"] in ("fixas", "condicao"):   # fora as linhas do manifesto
+            pares.setdefault((t["Prestador"], t["Competencia"]), {})[t["Esperas"]] = t
+    linhas = []
+    for (prestador, competencia), par in pares.items():
+        antes, depois = (par.get(e, {}).get("Segundos") for e in ("fixas", "condicao"))
+        erro = " | ".join(par[e]["Erro"] for e in par if par[e]["Erro"])
+        linhas.append({"Prestador": prestador, "Competencia": competencia, "Fixas (s)": antes, "Condicao (s)": depois,
+                       "Ganho (%)": round((1 - depois / antes) * 100, 1) if antes and depois is not None else None,
+                       "Erro": erro})
+    caminho_csv = os.path.join(base_download_dir, f"comparacao_esperas_{rotulo_competencias(competencias)}.csv")
+    arquivo_csv = io.StringIO(newline="")
+    writer = csv.DictWriter(arquivo_csv, fieldnames=["Prestador", "Competencia", "Fixas (s)", "Condicao (s)",
+                                                     "Ganho (%)", "Erro"])
+    writer.writeheader()
+    writer.writerows(linhas)
+    envio.gravar(caminho_csv, arquivo_csv.getvalue().encode("utf-8"))
+    validas = [l for l in linhas if l["Ganho (%)"] is not None and not l["Erro"]]
+    if validas:
+        antes, depois = (statistics.median(l[c] for l in validas) for c in ("Fixas (s)", "Condicao (s)"))
+        print(f"\n⚖️ Esperas fixas x por condição em {len(validas)} prestador(es)/competência(s): "
+              f"mediana {antes:.1f}s -> {depois:.1f}s ({(1 - depois / antes) * 100:.0f}% menos)")
+    print(f"📝 Comparação salva em: {caminho_csv}")
+
+# ======= PERFIL DE DESEMPENHO DO NAVEGADOR =======
+# bloqueio de imagens/terceiros e viewport menor; NFS_PERFIL=completo carrega tudo
+# (para comparar a medição). Headless é à parte e opcional: --headless / NFS_HEADLESS=1
+PERFIL_RAPIDO = os.environ.get("NFS_PERFIL", "rapido") != "completo"
+HEADLESS = os.environ.get("NFS_HEADLESS", "") == "1"
+VIEWPORT = {"width": 1024, "height": 768}
+medidor = MedidorNavegacao(bloquear=PERFIL_RAPIDO)
+
+# ======= EXPORTAÇÃO DIRETA (HTTP com a sessão do navegador) =======
+# NFS_EXPORTACAO_DIRETA=0 desliga e usa só o fluxo pela tela
+EXPORTACAO_DIRETA = os.environ.get("NFS_EXPORTACAO_DIRETA", "1") != "0"
+# XML: prólogo <?xml ou raiz de NFS-e (página de erro/login em HTML não passa); PDF: cabeçalho
+ASSINATURAS = {"xml": re.compile(rb"(?:<\?xml\b|<(?:\w+:)?\w*nfse\w*[\s/>])", re.IGNORECASE),
+               "pdf": re.compile(rb"%PDF-")}
+# a pesquisa só "tem registros" se a resposta trouxer o ícone da linha de resultado;
+# sem ele (ou resposta em outro formato) a tela cuida do caso (captura, declaração)
+SINAIS_REGISTRO = {"xml": "fa-search", "pdf": "fa-file-pdf-o"}
+CAMPOS_XML = ("parametrosTela.idPessoa", "parametrosTela.nrMesCompetencia",
+              "parametrosTela.nrAnoCompetencia", "parametrosTela.origemEmissaoNfse")
+CAMPOS_PDF = ("formulario.idPessoa", "formulario.tpOrigemNfs",
+              "formulario.nrMesCompetencia", "formulario.nrAnoCompetencia")
+
+def _requisicao(req):
+    # (método, url, campos) de uma requisição feita pela tela; no GET os campos
+    # vêm da query string, que sai da url e é remontada a cada envio
+    if req.method == "GET":
+        url, _, query = req.url.partition("?")
+        return req.method, url, parse_qsl(query, keep_blank_values=True)
+    return req.method, req.url, parse_qsl(req.post_data or "", keep_blank_values=True)
+
+def documento_prestador(nome_prestador):
+    # "12.345.678/0001-90 - CLIENTE" -> "12345678000190" (CNPJ/CPF do texto da opção)
+    prefixo = nome_prestador.split(" - ", 1)[0] if " - " in nome_prestador else ""
+    digitos = re.sub(r"\D", "", prefixo)
+    return digitos if len(digitos) in (11, 14) else None
+
+def xml_do_prestador(conteudo, nome_prestador):
+    """O XML exportado cita o CNPJ/CPF do prestador (sem ou com máscara). Sem
+    documento na opção não há como conferir: o chamador segue pela tela."""
+    documento = documento_prestador(nome_prestador)
+    if documento is None:
+        return False
+    mascarado = nome_prestador.split(" - ", 1)[0].strip()
+    return documento.encode() in conteudo or mascarado.encode("utf-8") in conteudo
+
+class ModelosHTTP:
+    """Requisições Pesquisar + Exportar que a tela dispara, gravadas na primeira
+    vez que o fluxo pela UI exporta com sucesso e reenviadas pelo APIRequestContext
+    (mesmos cookies do contexto) para os demais prestadores, trocando só os campos
+    de prestador/competência/origem.
+    A exportação usa a "última pesquisa" guardada na sessão do servidor: só vale
+    com um worker (com vários, todos dividem a sessão e uma pesquisa de outro
+    worker troca o prestador exportado). O main não cria modelos nesse caso."""
+
+    def __init__(self):
+        self.modelos = {}   # "xml"/"pdf" -> (pesquisa, exportação)
+        self.opcoes = {}    # nome do select -> [(texto, valor), ...]
+        self.lock = threading.Lock()
+
+    def gravar(self, tipo, pagina, resposta_pesquisa, req_exportacao, campos):
+        if resposta_pesquisa is None or req_exportacao is None or tipo in self.modelos:
+            return
+        with self.lock:
+            for nome in campos:
+                try:
+                    self.opcoes[nome] = pagina.eval_on_selector(
+                        f'select[name="{nome}"]', "s => Array.from(s.options).map(o => [o.text.trim(), o.value])")
+                except Exception:
+                    return
+            self.modelos[tipo] = (_requisicao(resposta_pesquisa.request), _requisicao(req_exportacao))
+        print(f"🔗 Exportação direta de {tipo.upper()} disponível para os próximos prestadores")
+
+    def valor(self, nome, index=None, texto=None):
+        opcoes = self.opcoes[nome]
+        if index is not None:
+            return opcoes[index][1]
+        return next(v for t, v in opcoes if t == str(texto))
+
+    def exportar(self, contexto, tipo, campos):
+        """Conteúdo do arquivo exportado ou None (sem modelo, sem registros,
+        sessão recusada...): nesses casos o chamador segue pela tela."""
+        if tipo not in self.modelos:
+            return None
+        pesquisa, exportacao = self.modelos[tipo]
+        try:
+            for etapa, (metodo, url, pares) in enumerate((pesquisa, exportacao)):
+                # a exportação pode depender só do estado da sessão deixado pela pesquisa
+                if etapa == 0 and any(nome not in dict(pares) for nome in campos):
+                    return None
+                pares = [(k, campos.get(k, v)) for k, v in pares]
+                if metodo == "POST":
+                    resposta = contexto.request.post(url, form=dict(pares), timeout=TIMEOUT_DOWNLOAD)
+                else:
+                    resposta = contexto.request.get(url, params=dict(pares) or None, timeout=TIMEOUT_DOWNLOAD)
+                if not resposta.ok:
+                    return None
+                if etapa == 0:
+                    html = resposta.text()
+                    if "Não há registros" in html or SINAIS_REGISTRO[tipo] not in html:
+                        return None
+            corpo = resposta.body()
+        except Exception as e:
+            print(f"⚠️ Exportação direta falhou ({tipo}): {e}")
+            return None
+        return corpo if ASSINATURAS[tipo].match(corpo.lstrip(b"\xef\xbb\xbf \t\r\n")) else None
+
+def pasta_do_prestador(nome_prestador, mes, ano):
+    # ✅ Nome do cliente limpo (sem CNPJ); a pasta é criada pelo envio
+    nome_limpo = nome_prestador.split(" - ", 1)[1] if " - " in nome_prestador else nome_prestador
+    return os.path.join(base_download_dir, nome_limpo.strip(), f"{str(mes).zfill(2)}.{ano}")
+
+def salvar_bytes(caminho, conteudo, rotulo):
+    if salvar_artefato(caminho, conteudo):
+        print(f"✅ {rotulo} salvo em (HTTP):\n{caminho}")
+
+# ======= MANIFESTO POR PASTA (reexecução sem baixar/regravar o que já está lá) =======
+# manifesto.json na pasta MM.AAAA do cliente: sha256, tamanho, notas e data de cada
+# arquivo, mais "completo" quando todos os artefatos esperados do prestador existem.
+# NFS_REFAZER=1 (ou --refazer) ignora o manifesto e processa todos de novo.
+ARQUIVO_MANIFESTO = "manifesto.json"
+REFAZER = os.environ.get("NFS_REFAZER", "") == "1"
+# notas do XML exportado: elementos CompNfse (ou Nfse, se não houver), com ou sem prefixo
+RE_NOTA_XML = [re.compile(rb"<(?:\w+:)?%s[\s/>]" % tag, re.IGNORECASE) for tag in (b"CompNfse", b"Nfse")]
+
+def contar_notas(conteudo):
+    for regex in RE_NOTA_XML:
+        total = len(regex.findall(conteudo))
+        if total:
+            return total
+    return 0
+
+def ler_manifesto(pasta):
+    # versão ainda no spool (não enviada) tem precedência sobre a do compartilhamento
+    try:
+        return json.loads(envio.ler(os.path.join(pasta, ARQUIVO_MANIFESTO)))
+    except (TypeError, ValueError):
+        return {"arquivos": {}}
+
+def gravar_manifesto(pasta, manifesto):
+    conteudo = json.dumps(manifesto, ensure_ascii=False, indent=2).encode("utf-8")
+    envio.gravar(os.path.join(pasta, ARQUIVO_MANIFESTO), conteudo)
+
+def salvar_artefato(caminho, conteudo):
+    """Grava o arquivo (via spool) e registra no manifesto da pasta. Se o conteúdo é o mesmo
+    (sha256) do arquivo já registrado, não regrava. Devolve True se gravou."""
+    pasta, nome = os.path.split(caminho)
+    manifesto = ler_manifesto(pasta)
+    sha = hashlib.sha256(conteudo).hexdigest()
+    anterior = manifesto["arquivos"].get(nome)
+    if anterior and anterior["sha256"] == sha and envio.tamanho(caminho) == anterior["tamanho"]:
+        print(f"⏭️ {nome} sem alterações (manifesto)")
+        return False
+    envio.gravar(caminho, conteudo)
+    manifesto["arquivos"][nome] = {
+        "sha256": sha, "tamanho": len(conteudo),
+        "notas": contar_notas(conteudo) if nome.endswith(".xml") else None,
+        "obtido_em": datetime.now().isoformat(timespec="seconds")}
+    gravar_manifesto(pasta, manifesto)
+    return True
+
+def salvar_download(download, caminho):
+    # lê o arquivo temporário do Playwright em vez de save_as: passa pelo manifesto
+    with open(download.path(), "rb") as f:
+        return salvar_artefato(caminho, f.read())
+
+def _registrado(pasta, manifesto, nome):
+    info = manifesto["arquivos"].get(nome)
+    return bool(info) and envio.tamanho(os.path.join(pasta, nome)) == info["tamanho"]
+
+def marcar_completo(pasta, esperados):
+    """Marca o prestador como completo se todos os artefatos esperados estão
+    registrados no manifesto e presentes na pasta."""
+    manifesto = ler_manifesto(pasta)
+    manifesto["completo"] = all(_registrado(pasta, manifesto, nome) for nome in esperados)
+    manifesto["esperados"] = sorted(esperados)
+    gravar_manifesto(pasta, manifesto)
+    return manifesto["completo"]
+
+def prestador_completo(nome_prestador, mes, ano):
+    pasta = pasta_do_prestador(nome_prestador, mes, ano)
+    manifesto = ler_manifesto(pasta)
+    return bool(manifesto.get("completo")) and all(
+        _registrado(pasta, manifesto, nome) for nome in manifesto.get("esperados", []))
+
+def exportar_xml_direto(contexto, modelos, nome_prestador, index, mes_anterior, ano_ref, mes_extenso, origem_texto):
+    try:
+        campos = {"parametrosTela.idPessoa": modelos.valor("parametrosTela.idPessoa", index=index),
+                  "parametrosTela.nrMesCompetencia": modelos.valor("parametrosTela.nrMesCompetencia", texto=mes_extenso),
+                  "parametrosTela.nrAnoCompetencia": modelos.valor("parametrosTela.nrAnoCompetencia", texto=ano_ref),
+                  "parametrosTela.origemEmissaoNfse": modelos.valor("parametrosTela.origemEmissaoNfse", texto=origem_texto)}
+    except (KeyError, StopIteration, IndexError):
+        return None
+    conteudo = modelos.exportar(contexto, "xml", campos)
+    if conteudo is None:
+        return None
+    if not xml_do_prestador(conteudo, nome_prestador):
+        print(f"⚠️ XML exportado não cita o documento de {nome_prestador}: descartado, segue pela tela")
+        return None
+    sufixo = "emitido" if origem_texto.lower() == "emitida" else "recebido"
+    pasta_mes_ano = pasta_do_prestador(nome_prestador, mes_anterior, ano_ref)
+    salvar_bytes(os.path.join(pasta_mes_ano, f"notas_{mes_extenso.lower()}_{ano_ref}_{sufixo}.xml"), conteudo, "XML")
+    return pasta_mes_ano
+
+def exportar_pdf_direto(contexto, modelos, nome_prestador, index, mes_anterior, ano_ref, mes_extenso, origem_texto):
+    try:
+        campos = {"formulario.idPessoa": modelos.valor("formulario.idPessoa", index=index),
+                  "formulario.tpOrigemNfs": modelos.valor("formulario.tpOrigemNfs", texto=origem_texto),
+                  "formulario.nrMesCompetencia": modelos.valor("formulario.nrMesCompetencia", texto=mes_anterior),
+                  "formulario.nrAnoCompetencia": modelos.valor("formulario.nrAnoCompetencia", texto=ano_ref)}
+    except (KeyError, StopIteration, IndexError):
+        return False
+    conteudo = modelos.exportar(contexto, "pdf", campos)
+    if conteudo is None:
+        return False
+    sufixo = "emitido" if origem_texto.lower() == "emitida" else "recebido"
+    pasta_mes_ano = pasta_do_prestador(nome_prestador, mes_anterior, ano_ref)
+    salvar_bytes(os.path.join(pasta_mes_ano, f"notas_{mes_extenso.lower()}_{ano_ref}_{sufixo}.pdf"), conteudo,
+                 f"PDF {origem_texto.upper()}")
+    return True
+
 def salvar_captura_de_tela_declaracao(pagina, caminho, mes, ano):
     nome_arquivo = f"declaracao_sem_movimento_{str(mes).zfill(2)}.{ano}.png"
     caminho_arquivo = os.path.join(caminho, nome_arquivo)
     try:
-        pagina.screenshot(path=caminho_arquivo, full_page=True)
+        salvar_artefato(caminho_arquivo, pagina.screenshot(full_page=True))
         print(f"📸 Captura de tela salva em: {caminho_arquivo}")
     except Exception as e:
         print(f"❗ Erro ao salvar captura de tela: {e}")
@@ -20,7 +409,7 @@ def salvar_captura_de_tela(pagina, caminho, mes, ano, sufixo):
     nome_arquivo = f"sem_movimento_{str(mes).zfill(2)}.{ano}_{sufixo}.png"
     caminho_arquivo = os.path.join(caminho, nome_arquivo)
     try:
-        pagina.screenshot(path=caminho_arquivo, full_page=True)
+        salvar_artefato(caminho_arquivo, pagina.screenshot(full_page=True))
         print(f"📸 Captura de tela salva em: {caminho_arquivo}")
     except Exception as e:
         print(f"❗ Erro ao salvar captura de tela: {e}")
@@ -52,14 +441,13 @@ def emitir_declaracoes_disponiveis(pagina, nome_prestador, mes, ano, base_downlo
                 # ✅ Nome do cliente limpo (sem CNPJ)
             nome_limpo = nome_prestador.split(" - ", 1)[1] if " - " in nome_prestador else nome_prestador
             pasta_cliente = os.path.join(base_download_dir, nome_limpo.strip())
-            pasta_mes_ano = os.path.join(pasta_cliente, f"{str(mes_anterior).zfill(2)}.{ano_ref}")
-            os.makedirs(pasta_mes_ano, exist_ok=True)
+            pasta_mes_ano = os.path.join(pasta_cliente, f"{str(mes).zfill(2)}.{ano}")
 
 
             if not botoes_disponiveis:
                 print("✅ Nenhum botão de declaração disponível. Salvando captura de tela.")
-                salvar_captura_de_tela_declaracao(pagina, pasta_mes_ano, mes_anterior, ano_ref)
-                time.sleep(3)
+                salvar_captura_de_tela_declaracao(pagina, pasta_mes_ano, mes, ano)
+                pausa_legada(pagina, 3000)
                 break
             
             for numero_mes in sorted(set(botoes_disponiveis)):
@@ -71,18 +459,18 @@ def emitir_declaracoes_disponiveis(pagina, nome_prestador, mes, ano, base_downlo
                     print(f"❗ Erro ao executar emitirDeclaracao('{numero_mes}'): {e}")
                     continue
 
-                pagina.wait_for_timeout(2000)
+                pausa_legada(pagina, 2000)
 
                 try:
-                    pagina.click("text=Gravar", timeout=3000)
-                    pagina.wait_for_timeout(2000)
+                    gravar = pagina.locator("text=Gravar")
+                    gravar.wait_for(state="visible", timeout=5000)  # mesmo limite de antes (2s + 3s)
+                    clicar_e_aguardar(pagina, gravar)
                     print(f"✅ Declaração do mês {numero_mes} gravada com sucesso.")
-                except TimeoutError:
+                except (TimeoutError, PlaywrightTimeoutError):
                     print(f"❗ Botão 'Gravar' não encontrado após o mês {numero_mes}.")
 
                 try:
-                    pagina.click("text=Pesquisar")
-                    pagina.wait_for_timeout(2000)
+                    clicar_e_aguardar(pagina, "text=Pesquisar", pronto=resultado_pesquisa(pagina, "table"), renovar=True)
                 except Exception as e:
                     print(f"❗ Erro ao clicar em 'Pesquisar': {e}")
                     break
@@ -93,11 +481,11 @@ def emitir_declaracoes_disponiveis(pagina, nome_prestador, mes, ano, base_downlo
             print(f"❗ Erro inesperado: {e}")
             break
 
-def baixar_arquivos(pagina, nome_prestador, mes_extenso, ano_ref, mes_anterior, origem_texto, tem_registro, index):
-    pagina.click("text=Pesquisar")
-
+def baixar_arquivos(pagina, nome_prestador, mes_extenso, ano_ref, mes_anterior, origem_texto, tem_registro, index, modelos=None):
+    resposta_pesquisa = None
     try:
-        pagina.wait_for_timeout(1500)
+        resposta_pesquisa = clicar_e_aguardar(pagina, "text=Pesquisar", pronto=resultado_pesquisa(pagina), legado=1500,
+                                               renovar=True)
 
         if pagina.is_visible("text=Não há registros"):
             tem_registro = False
@@ -116,14 +504,16 @@ def baixar_arquivos(pagina, nome_prestador, mes_extenso, ano_ref, mes_anterior,
     nome_limpo = nome_prestador.split(" - ", 1)[1] if " - " in nome_prestador else nome_prestador
     pasta_cliente = os.path.join(base_download_dir, nome_limpo.strip())
     pasta_mes_ano = os.path.join(pasta_cliente, f"{str(mes_anterior).zfill(2)}.{ano_ref}")
-    os.makedirs(pasta_mes_ano, exist_ok=True)
 
     try:
         if tem_registro:
-            with pagina.expect_download(timeout=10000) as download_info:
+            with pagina.expect_request(lambda r: r.resource_type in ("document", "xhr", "fetch")) as req_info, \
+                    pagina.expect_download(timeout=TIMEOUT_DOWNLOAD) as download_info:
                 pagina.click("text=Exportar em XML")
             download = download_info.value
             nome_arquivo_xml = f"notas_{mes_extenso.lower()}_{ano_ref}_{sufixo}.xml"
+            if modelos is not None and req_info.value.url == download.url:
+                modelos.gravar("xml", pagina, resposta_pesquisa, req_info.value, CAMPOS_XML)
         else:
                 salvar_captura_de_tela(pagina, pasta_mes_ano, mes_anterior, ano_ref, sufixo)
                 
@@ -132,10 +522,8 @@ def baixar_arquivos(pagina, nome_prestador, mes_extenso, ano_ref, mes_anterior,
 
                         print(f"⚠️ Sem registros para {nome_prestador}. Emitindo declaração sem movimento.")
                         pagina.click("text=DECLARAÇÃO")
-                        pagina.click("text=Sem movimento")
-                        time.sleep(3)
-                        pagina.click("text=Pesquisar")
-                        pagina.wait_for_timeout(2000)
+                        clicar_e_aguardar(pagina, "text=Sem movimento", pronto="text=Pesquisar", legado=3000)
+                        clicar_e_aguardar(pagina, "text=Pesquisar", pronto=resultado_pesquisa(pagina, "table"), renovar=True)
 
                         emitir_declaracoes_disponiveis(
                             pagina,
@@ -147,9 +535,7 @@ def baixar_arquivos(pagina, nome_prestador, mes_extenso, ano_ref, mes_anterior,
                             modo_debug=True
                         )
 
-                        pagina.click("text=NFS-E")
-                        pagina.click("text=Consulta")
-                        time.sleep(1)
+                        abrir_tela(pagina, "NFS-E", "Consulta", "parametrosTela.idPessoa")
 
                         prestador_select = pagina.locator('select[name="parametrosTela.idPessoa"]')
                         prestador_select.select_option(index=index)
@@ -168,7 +554,7 @@ def baixar_arquivos(pagina, nome_prestador, mes_extenso, ano_ref, mes_anterior,
         
         caminho_final_xml = os.path.join(pasta_mes_ano, nome_arquivo_xml)
         if download:
-            download.save_as(caminho_final_xml)
+            salvar_download(download, caminho_final_xml)
             print(f"✅ XML salvo em:\n{caminho_final_xml}")
         else:
             print(f"ℹ️ Nenhum XML gerado para {sufixo.upper()} ({nome_prestador})")
@@ -179,30 +565,33 @@ def baixar_arquivos(pagina, nome_prestador, mes_extenso, ano_ref, mes_anterior,
         print(f"⚠️ Falha ao exportar XML ({sufixo}): {e}")
         return False, pasta_mes_ano
 
-def baixar_relatorio(pagina, nome_prestador, mes_extenso, ano_ref, mes_anterior, pasta_mes_ano, tem_registro_emitida, tem_registro_recebida):
+def baixar_relatorio(pagina, nome_prestador, mes_extenso, ano_ref, mes_anterior, pasta_mes_ano, tem_registro_emitida, tem_registro_recebida, index, modelos=None):
     try:
         if tem_registro_emitida:
             pagina.select_option('select[name="formulario.tpOrigemNfs"]', label="Emitida")
             pagina.select_option('select[name="formulario.nrMesCompetencia"]', label=str(mes_anterior))
             pagina.select_option('select[name="formulario.nrAnoCompetencia"]', str(ano_ref))
-            pagina.locator('input[value="Pesquisar"]').click()
-
-            pagina.wait_for_timeout(2000)
             print("Mes anterior: ",mes_anterior)
             try:
-                with pagina.expect_download(timeout=10000) as download_info:
+                # pesquisa sem ícone de PDF cai aqui, como o sleep fixo antigo: segue para Limpar/Recebida
+                resposta_pesquisa = clicar_e_aguardar(pagina, 'input[value="Pesquisar"]', pronto="span.pdf.fa.fa-file-pdf-o",
+                                                      renovar=True)
+                with pagina.expect_request(lambda r: r.resource_type in ("document", "xhr", "fetch")) as req_info, \
+                        pagina.expect_download(timeout=TIMEOUT_DOWNLOAD) as download_info:
                     pagina.locator('span.pdf.fa.fa-file-pdf-o').click()
                 download_pdf = download_info.value
+                if modelos is not None and req_info.value.url == download_pdf.url:
+                    modelos.gravar("pdf", pagina, resposta_pesquisa, req_info.value, CAMPOS_PDF)
                 nome_arquivo_pdf = f"notas_{mes_extenso.lower()}_{ano_ref}_emitido.pdf"
                 caminho_final_pdf = os.path.join(pasta_mes_ano, nome_arquivo_pdf)
-                download_pdf.save_as(caminho_final_pdf)
+                salvar_download(download_pdf, caminho_final_pdf)
                 print(f"✅ PDF EMITIDA salvo em:\n{caminho_final_pdf}")
                 
             except Exception as e:
                 print(f"⚠️ Falha ao exportar PDF Emitida: {e}")
                 
             pagina.click("text=Limpar")
-            time.sleep(0.5)
+            aguardar_ocioso(pagina)
         
         print("Mes anterior: ",mes_anterior)
 
@@ -210,40 +599,32 @@ def baixar_relatorio(pagina, nome_prestador, mes_extenso, ano_ref, mes_anterior,
             pagina.select_option('select[name="formulario.tpOrigemNfs"]', label="Recebida")
             pagina.select_option('select[name="formulario.nrMesCompetencia"]', label=str(mes_anterior))
             pagina.select_option('select[name="formulario.nrAnoCompetencia"]', str(ano_ref))
-            pagina.locator('input[value="Pesquisar"]').click()
-
-            pagina.wait_for_timeout(2000)
             try:
-                with pagina.expect_download(timeout=10000) as download_info:
+                resposta_pesquisa = clicar_e_aguardar(pagina, 'input[value="Pesquisar"]', pronto="span.pdf.fa.fa-file-pdf-o",
+                                                      renovar=True)
+                with pagina.expect_request(lambda r: r.resource_type in ("document", "xhr", "fetch")) as req_info, \
+                        pagina.expect_download(timeout=TIMEOUT_DOWNLOAD) as download_info:
                     pagina.locator('span.pdf.fa.fa-file-pdf-o').click()
                 download_pdf = download_info.value
+                if modelos is not None and req_info.value.url == download_pdf.url:
+                    modelos.gravar("pdf", pagina, resposta_pesquisa, req_info.value, CAMPOS_PDF)
                 nome_arquivo_pdf = f"notas_{mes_extenso.lower()}_{ano_ref}_recebido.pdf"
                 caminho_final_pdf = os.path.join(pasta_mes_ano, nome_arquivo_pdf)
-                download_pdf.save_as(caminho_final_pdf)
+                salvar_download(download_pdf, caminho_final_pdf)
                 print(f"✅ PDF RECEBIDA salvo em:\n{caminho_final_pdf}")
             except Exception as e:
                 print(f"⚠️ Falha ao exportar PDF Recebida: {e}")
                 
             pagina.click("text=Limpar")
-            time.sleep(0.5)
+            aguardar_ocioso(pagina)
 
     except Exception as e:
         print(f"⚠️ Erro ao baixar relatórios: {e}")
 
     # 🔄 Volta para tela de consulta e aguarda corretamente
     try:
-        pagina.click("text=NFS-E")
-        pagina.click("text=Consulta")
-        
-        pagina.wait_for_function(
-            """() => {
-                const select = document.querySelector('select[name="parametrosTela.idPessoa"]');
-                return select && select.options.length > 1;
-            }""",
-            timeout=15000
-        )
+        abrir_tela(pagina, "NFS-E", "Consulta", "parametrosTela.idPessoa", legado=0)
 
-        
         pagina.wait_for_selector('select[name="parametrosTela.idPessoa"]')
         # Após navegação, é necessário re-obter o seletor
         prestador_select = pagina.locator('select[name="parametrosTela.idPessoa"]')
@@ -253,100 +634,342 @@ def baixar_relatorio(pagina, nome_prestador, mes_extenso, ano_ref, mes_anterior,
         pagina.select_option('select[name="parametrosTela.nrMesCompetencia"]', label=mes_extenso)
         pagina.select_option('select[name="parametrosTela.nrAnoCompetencia"]', str(ano_ref))
 
-        time.sleep(1)
+        pausa_legada(pagina, 1000)
 
     except Exception as e:
         print(f"❗ Erro ao retornar para tela de consulta: {e}")
 
-with sync_playwright() as p:
-    navegador = p.chromium.launch(channel="chrome", headless=False)
-    contexto = navegador.new_context(accept_downloads=True)
-    pagina = contexto.new_page()
-
-    pagina.goto("https://www.esnfs.com.br/?e=35")
-    time.sleep(2)
+# ======= FLUXO POR PRESTADOR =======
+URL_PORTAL = "https://www.esnfs.com.br/?e=35"
+ARQUIVO_SESSAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessao_esnfs.json")
+MESES_EXT = ["Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
+             "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"]
+
+def competencias_entre(de, ate):
+    """[(mes, ano, mes_extenso), ...] de `de` até `ate` (tuplas (ano, mes)), inclusive."""
+    (ano, mes), fim = de, ate
+    competencias = []
+    while (ano, mes) <= fim:
+        competencias.append((mes, ano, MESES_EXT[mes - 1]))
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+    return competencias
+
+def registro_prestador(nome, competencia, erro="", worker=None, **campos):
+    # linha do CSV de tempos; campos ausentes ficam vazios
+    return {"Prestador": nome, "Competencia": f"{str(competencia[0]).zfill(2)}/{competencia[1]}",
+            "Segundos": None, "Emitida": None, "Recebida": None,
+            "Esperas": "fixas" if ESPERAS_FIXAS else "condicao",
+            "Worker": worker or threading.current_thread().name, "Via": "-", "Erro": erro, **campos}
+
+def abrir_navegador(p, headless=False):
+    return p.chromium.launch(channel="chrome", headless=headless, args=medidor.argumentos())
+
+def novo_contexto(navegador, storage_state=None):
+    extras = {"viewport": VIEWPORT} if PERFIL_RAPIDO else {}
+    contexto = navegador.new_context(accept_downloads=True, storage_state=storage_state, **extras)
+    medidor.acompanhar(contexto)
+    contexto.set_default_timeout(TIMEOUT_PADRAO)
+    return contexto
+
+def login(pagina):
+    pagina.goto(URL_PORTAL)
+    pausa_legada(pagina, 2000)
 
     pagina.wait_for_selector("text=Certificado digital")
     pagina.click("text=Certificado digital")
 
     pagina.wait_for_load_state("networkidle")
-    time.sleep(1)
+    pausa_legada(pagina, 1000)
 
     pagina.wait_for_selector("text=Município de Francisco Beltrão")
     pagina.click("text=Município de Francisco Beltrão")
 
     pagina.wait_for_load_state("networkidle")
-    time.sleep(1)
-
-    pagina.click("text=NFS-E")
-    pagina.click("text=Consulta")
-    time.sleep(1)
-
-    pagina.wait_for_selector('select[name="parametrosTela.idPessoa"]')
-    prestador_select = pagina.locator('select[name="parametrosTela.idPessoa"]')
-    prestadores = prestador_select.locator("option").all()
-    total_prestadores = len(prestadores)
-
-    if total_prestadores < 2:
-        raise Exception("❌ Nenhum prestador válido encontrado.")
-
-    hoje = datetime.today()
-    mes_anterior = hoje.month - 1 or 12
-    ano_ref = hoje.year if hoje.month > 1 else hoje.year - 1
-    meses_ext = ["Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
-                 "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"]
-    mes_extenso = meses_ext[mes_anterior - 1]
+    pausa_legada(pagina, 1000)
+
+def abrir_consulta(pagina):
+    abrir_tela(pagina, "NFS-E", "Consulta", "parametrosTela.idPessoa")
+
+def confirmar_sessao(pagina):
+    """Página nova de um worker: a sessão herdada tem de estar no município (menu
+    NFS-E visível). Se o portal voltar à escolha do município, repete o clique; se
+    pedir o certificado de novo, o worker para em vez de seguir deslogado."""
+    pagina.goto(URL_PORTAL)
+    aguardar_ocioso(pagina, legado=1000)
+    menu = pagina.locator("text=NFS-E").first
+    municipio = pagina.locator("text=Município de Francisco Beltrão").first
+    menu.or_(municipio).or_(pagina.locator("text=Certificado digital")).first.wait_for(state="visible")
+    if not menu.is_visible() and municipio.is_visible():
+        municipio.click()
+        aguardar_ocioso(pagina, legado=1000)
+    try:
+        menu.wait_for(state="visible", timeout=5000)
+    except PlaywrightTimeoutError:
+        raise RuntimeError("sessão herdada não está logada no portal (menu NFS-E ausente)") from None
 
-    for index in range(1, total_prestadores):
-        nome_prestador_completo = prestadores[index].text_content().strip()
-        print(f"\n🔍 Processando prestador: {nome_prestador_completo}")
+def processar_prestador(pagina, index, nome_prestador_completo, mes_anterior, ano_ref, mes_extenso, modelos=None):
+    """Emitidas/Recebidas (XML) e Apuração do ISS (PDF) de um prestador, a
+    partir da tela de Consulta. Devolve o registro de tempo/resultado."""
+    print(f"\n🔍 Processando prestador: {nome_prestador_completo}")
+    inicio_prestador = time.perf_counter()
 
-        # Limpar antes de buscar novo
-        pagina.click("text=Limpar")
-        time.sleep(0.5)
+    # Limpar antes de buscar novo
+    pagina.click("text=Limpar")
+    aguardar_ocioso(pagina)
 
-        prestador_select = pagina.locator('select[name="parametrosTela.idPessoa"]')
+    prestador_select = pagina.locator('select[name="parametrosTela.idPessoa"]')
+    prestador_select.select_option(index=index)
+
+    pagina.wait_for_selector('select[name="parametrosTela.nrMesCompetencia"]')
+    pagina.select_option('select[name="parametrosTela.nrMesCompetencia"]', label=mes_extenso)
+    pagina.select_option('select[name="parametrosTela.nrAnoCompetencia"]', str(ano_ref))
+
+    # Emitidas e Recebidas: HTTP direto quando há modelo gravado; sem registros
+    # (ou qualquer falha) segue pela tela, que cuida da captura/declaração
+    vias = set()
+    tem_registro = {}
+    for origem in ("Emitida", "Recebida"):
+        pasta = None
+        if modelos is not None:
+            pasta = exportar_xml_direto(pagina.context, modelos, nome_prestador_completo, index,
+                                        mes_anterior, ano_ref, mes_extenso, origem)
+        if pasta is not None:
+            tem_registro[origem], pasta_mes_ano = True, pasta
+            vias.add("http")
+        else:
+            pagina.select_option('select[name="parametrosTela.origemEmissaoNfse"]', label=origem)
+            tem_registro[origem], pasta_mes_ano = baixar_arquivos(pagina, nome_prestador_completo, mes_extenso, ano_ref,
+                                                                  mes_anterior, origem, True, index, modelos)
+            vias.add("ui")
+    tem_registro_emitida, tem_registro_recebida = tem_registro["Emitida"], tem_registro["Recebida"]
+
+    # PDFs da Apuração: só abre a tela para os que não saíram por HTTP
+    pendentes = {origem: tem for origem, tem in tem_registro.items()
+                 if tem and not (modelos is not None and exportar_pdf_direto(
+                     pagina.context, modelos, nome_prestador_completo, index, mes_anterior, ano_ref, mes_extenso, origem))}
+    if len(pendentes) < sum(tem_registro.values()):
+        vias.add("http")
+
+    if pendentes.get("Emitida") or pendentes.get("Recebida"):
+        vias.add("ui")
+        abrir_tela(pagina, "RELATÓRIOS", "Apuração do ISS", "formulario.idPessoa")
+
+        prestador_select = pagina.locator('select[name="formulario.idPessoa"]')
         prestador_select.select_option(index=index)
 
-        pagina.wait_for_selector('select[name="parametrosTela.nrMesCompetencia"]')
-        pagina.select_option('select[name="parametrosTela.nrMesCompetencia"]', label=mes_extenso)
-        pagina.select_option('select[name="parametrosTela.nrAnoCompetencia"]', str(ano_ref))
-
-        # Emitidas
-        pagina.select_option('select[name="parametrosTela.origemEmissaoNfse"]', label="Emitida")
-        tem_registro_emitida, pasta_mes_ano = baixar_arquivos(pagina, nome_prestador_completo, mes_extenso, ano_ref, mes_anterior, "Emitida", True, index)
-        # Recebidas
-        pagina.select_option('select[name="parametrosTela.origemEmissaoNfse"]', label="Recebida")
-        tem_registro_recebida, pasta_mes_ano = baixar_arquivos(pagina, nome_prestador_completo, mes_extenso, ano_ref, mes_anterior, "Recebida", True, index)
-
-        if tem_registro_emitida == True or tem_registro_recebida == True:
-            pagina.click("text=RELATÓRIOS")
-            pagina.click("text=Apuração do ISS")
-            time.sleep(1)
-
-            prestador_select = pagina.locator('select[name="formulario.idPessoa"]')
-            prestador_select = pagina.locator('select[name="formulario.idPessoa"]')
-            prestador_select.select_option(index=index)
 
+        pagina.wait_for_selector('select[name="formulario.nrMesCompetencia"]')
+        pagina.select_option('select[name="formulario.nrMesCompetencia"]', label=str(mes_anterior))
+        pagina.select_option('select[name="formulario.nrAnoCompetencia"]', str(ano_ref))
+
+        baixar_relatorio(
+            pagina,
+            nome_prestador_completo,
+            mes_extenso,
+            ano_ref,
+            mes_anterior,
+            pasta_mes_ano,
+            pendentes.get("Emitida", False),
+            pendentes.get("Recebida", False),
+            index,
+            modelos
+        )
 
-            pagina.wait_for_selector('select[name="formulario.nrMesCompetencia"]')
-            pagina.select_option('select[name="formulario.nrMesCompetencia"]', label=str(mes_anterior))
-            pagina.select_option('select[name="formulario.nrAnoCompetencia"]', str(ano_ref))
-            
-            baixar_relatorio(
-                pagina,
-                nome_prestador_completo,
-                mes_extenso,
-                ano_ref,
-                mes_anterior,
-                pasta_mes_ano,
-                tem_registro_emitida,
-                tem_registro_recebida
-            )
+    # o que deve existir na pasta para a próxima execução pular este prestador
+    esperados = []
+    for origem, tem in tem_registro.items():
+        sufixo = "emitido" if origem == "Emitida" else "recebido"
+        if tem:
+            esperados += [f"notas_{mes_extenso.lower()}_{ano_ref}_{sufixo}.xml",
+                          f"notas_{mes_extenso.lower()}_{ano_ref}_{sufixo}.pdf"]
+        else:
+            esperados.append(f"sem_movimento_{str(mes_anterior).zfill(2)}.{ano_ref}_{sufixo}.png")
+    if not marcar_completo(pasta_mes_ano, esperados):
+        print("⚠️ Artefatos incompletos: prestador será refeito na próxima execução")
+
+    segundos = time.perf_counter() - inicio_prestador
+    print(f"⏱️ Prestador concluído em {segundos:.1f}s")
+    return registro_prestador(nome_prestador_completo, (mes_anterior, ano_ref), Segundos=round(segundos, 2),
+                              Emitida=tem_registro_emitida, Recebida=tem_registro_recebida, Via="+".join(sorted(vias)))
+
+def processar_com_recuperacao(pagina, index, nome, competencias, modelos=None):
+    """Todas as competências pendentes de um prestador em sequência, na mesma
+    sessão. Falha numa competência não derruba o worker: registra, volta para
+    a Consulta e segue para a próxima."""
+    registros = []
+    for competencia in competencias:
+        try:
+            registros.append(processar_prestador(pagina, index, nome, *competencia, modelos=modelos))
+        except Exception as e:
+            print(f"❌ Falha no prestador {nome} ({competencia[2]}/{competencia[1]}): {e}")
+            registros.append(registro_prestador(nome, competencia, erro=str(e)))
+            try:
+                abrir_consulta(pagina)
+            except Exception as e2:
+                print(f"❗ Erro ao retornar para tela de consulta: {e2}")
+    return registros
+
+def comparar_esperas(pagina, pendentes, quantidade):
+    """Medição antes/depois: os primeiros `quantidade` prestadores pendentes com as
+    esperas fixas antigas e de novo com as esperas por condição, na mesma sessão
+    (sem exportação direta nas duas passadas, para medir só as esperas)."""
+    global ESPERAS_FIXAS
+    original, tempos = ESPERAS_FIXAS, []
+    try:
+        for fixas in (True, False):
+            ESPERAS_FIXAS = fixas
+            print(f"\n⚖️ Passada com esperas {'fixas' if fixas else 'por condição'}")
+            for index, nome, faltam in pendentes[:quantidade]:
+                tempos += processar_com_recuperacao(pagina, index, nome, faltam)
+    finally:
+        ESPERAS_FIXAS = original
+    return tempos
+
+# ======= POOL DE WORKERS (um contexto por worker, mesma sessão) =======
+# a sessão do servidor é uma só (cookies do login) e não foi confirmado que o portal
+# aceita consultas simultâneas nela: o formulário de um worker pode interferir no de
+# outro. Por isso o padrão é 1 worker e a exportação direta fica desligada com vários.
+def worker_prestadores(fila, resultados, modelos=None, headless=False):
+    """Thread do pool: navegador próprio (a API sync do Playwright é por thread),
+    contexto criado a partir do storage_state do login e a fila de prestadores.
+    Pode rodar headless: o certificado só é pedido no login."""
+    with sync_playwright() as p:
+        navegador = abrir_navegador(p, headless=headless)
+        contexto = novo_contexto(navegador, storage_state=ARQUIVO_SESSAO)
+        pagina = contexto.new_page()
+        try:
+            confirmar_sessao(pagina)
+            abrir_consulta(pagina)
+            while True:
+                try:
+                    index, nome, competencias = fila.get_nowait()
+                except queue.Empty:
+                    break
+                resultados[index] = processar_com_recuperacao(pagina, index, nome, competencias, modelos)
+        finally:
+            navegador.close()
+
+def processar_em_paralelo(prestadores, workers, modelos=None, headless=False):
+    # prestadores: [(index, nome, competências pendentes), ...]
+    fila = queue.Queue()
+    for item in prestadores:
+        fila.put(item)
+    resultados = {}
+    print(f"\n🚀 {len(prestadores)} prestador(es) em {workers} worker(s)")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="worker") as pool:
+        for fut in [pool.submit(worker_prestadores, fila, resultados, modelos, headless) for _ in range(workers)]:
+            try:
+                fut.result()
+            except Exception as e:
+                print(f"❌ Worker encerrado com erro: {e}")
+    # prestadores que sobraram na fila (worker caiu ao abrir o navegador/sessão)
+    for index, nome, competencias in prestadores:
+        if index not in resultados:
+            resultados[index] = [registro_prestador(nome, c, erro="não processado", worker="-") for c in competencias]
+    return [r for index, _, _ in prestadores for r in resultados[index]]
+
+def _ano_mes(texto):
+    try:
+        data = datetime.strptime(texto, "%Y-%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"competência inválida: {texto!r} (use AAAA-MM)")
+    return data.year, data.month
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Download de XML/PDF das NFS-e no portal ESNFS.")
+    ap.add_argument("--de", "--from", dest="de", type=_ano_mes, metavar="AAAA-MM",
+                    help="primeira competência do intervalo (padrão: mês anterior)")
+    ap.add_argument("--ate", "--to", dest="ate", type=_ano_mes, metavar="AAAA-MM",
+                    help="última competência do intervalo (padrão: igual a --de)")
+    ap.add_argument("--headless", action="store_true", default=HEADLESS,
+                    help="processa os prestadores em navegador headless (o login com certificado segue visível)")
+    ap.add_argument("--refazer", action="store_true", default=REFAZER,
+                    help="ignora o manifesto e processa também os prestadores já completos")
+    ap.add_argument("--comparar-esperas", type=int, default=0, metavar="N",
+                    help="mede os N primeiros prestadores pendentes com as esperas fixas antigas e com as "
+                         "por condição e grava comparacao_esperas_*.csv (use --refazer para já baixados)")
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("NFS_WORKERS", "1")),
+                    help="contextos de navegador em paralelo (padrão 1 = sequencial; respeite o limite do portal). "
+                         "Todos usam a mesma sessão do login: não há garantia de que o portal aceite "
+                         "telas de consulta simultâneas na mesma sessão; confira os resultados")
+    args = ap.parse_args(argv)
+    hoje = datetime.today()
+    args.de = args.de or ((hoje.year, hoje.month - 1) if hoje.month > 1 else (hoje.year - 1, 12))
+    args.ate = args.ate or args.de
+    if args.ate < args.de:
+        ap.error("--ate anterior a --de")
+    if args.comparar_esperas and (args.workers > 1 or args.headless):
+        ap.error("--comparar-esperas roda no fluxo sequencial (sem --workers/--headless)")
+    return args
+
+def main():
+    args = parse_args()
+    competencias = competencias_entre(args.de, args.ate)
+    if len(competencias) > 1:
+        print(f"📅 {len(competencias)} competências: {competencias[0][2]}/{competencias[0][1]} "
+              f"a {competencias[-1][2]}/{competencias[-1][1]} (um login, todas por prestador)")
+    # com vários workers a sessão é compartilhada: a reexecução poderia exportar outro prestador
+    modelos = ModelosHTTP() if EXPORTACAO_DIRETA and args.workers <= 1 else None
+    if EXPORTACAO_DIRETA and modelos is None:
+        print("ℹ️ Exportação direta desligada com --workers > 1 (sessão compartilhada)")
+
+    with sync_playwright() as p:
+        # login sempre visível: a escolha do certificado digital é feita na janela
+        navegador = abrir_navegador(p)
+        contexto = novo_contexto(navegador)
+        pagina = contexto.new_page()
+
+        login(pagina)
+        abrir_consulta(pagina)
 
+        prestador_select = pagina.locator('select[name="parametrosTela.idPessoa"]')
+        prestadores = [(i, o.text_content().strip()) for i, o in enumerate(prestador_select.locator("option").all())][1:]
+
+        if not prestadores:
+            raise Exception("❌ Nenhum prestador válido encontrado.")
+
+        # reexecução: competências com todos os artefatos no manifesto não são reabertas
+        completos, pendentes = [], []
+        for index, nome in prestadores:
+            feitas = [] if args.refazer else [c for c in competencias if prestador_completo(nome, c[0], c[1])]
+            completos += [(nome, c) for c in feitas]
+            faltam = [c for c in competencias if c not in feitas]
+            if faltam:
+                pendentes.append((index, nome, faltam))
+        if completos:
+            print(f"⏭️ {len(completos)} prestador(es)/competência(s) já completos no manifesto "
+                  f"(use --refazer para baixar de novo)")
+
+        # padrão: segue na mesma página do login. --headless (mesmo com 1 worker) passa
+        # o processamento para navegador(es) headless com a sessão herdada
+        if args.comparar_esperas:
+            tempos = comparar_esperas(pagina, pendentes, args.comparar_esperas)
+        elif args.workers <= 1 and not args.headless:
+            tempos = [r for index, nome, faltam in pendentes
+                      for r in processar_com_recuperacao(pagina, index, nome, faltam, modelos)]
+        else:
+            # login uma vez só: os workers herdam cookies/sessão do arquivo
+            contexto.storage_state(path=ARQUIVO_SESSAO)
+            navegador.close()
+            try:
+                tempos = processar_em_paralelo(pendentes, max(args.workers, 1), modelos, args.headless)
+            finally:
+                os.remove(ARQUIVO_SESSAO)  # cookies da sessão: não deixa em disco
+
+    tempos += [registro_prestador(nome, c, worker="-", Esperas="-", Via="manifesto") for nome, c in completos]
+    salvar_tempos_em_csv(tempos, competencias)
+    if args.comparar_esperas:
+        salvar_comparacao_esperas(tempos, competencias)
+    medidor.relatorio(os.path.join(base_download_dir, f"navegacoes_{rotulo_competencias(competencias)}.csv"), envio)
+    # principal.py lê do compartilhamento: só segue com a fila de envio vazia
+    if not envio.drenar():
+        print("⚠️ Há arquivos não enviados ao compartilhamento (ver acima)")
 
     # Caminho para o script principal.py
     CAMINHO_PRINCIPAL = r"C:\Users\Usuario\Documents\PYTHON\IMPORTADOR_NFSE\principal.py"
 
     print("\n🚀 Executando principal.py...")
-    subprocess.run(["python", CAMINHO_PRINCIPAL], check=True)
\ No newline at end of file
+    subprocess.run(["python", CAMINHO_PRINCIPAL], check=True)
+
+if __name__ == "__main__":
+    main()